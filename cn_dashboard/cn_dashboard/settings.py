@@ -17,7 +17,11 @@ import environ
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 env = environ.Env(
-    DEBUG=(bool, False)
+    DEBUG=(bool, False),
+    CANVAS_BACKEND=(str, "rest"),
+    CANVAS_FETCH_MODE=(str, "courses"),
+    CANVAS_CACHE_DIR=(str, ""),
+    SYNC_ENGINE=(str, "threads"),
 )
 
 environ.Env.read_env(BASE_DIR / ".env")
@@ -28,6 +32,15 @@ environ.Env.read_env(BASE_DIR / ".env")
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env("DEBUG")
 
+# How imports talk to Canvas: "rest" (one request per course) or "graphql" (bulk fetch)
+CANVAS_BACKEND = env("CANVAS_BACKEND")
+# "courses" fetches each course's assignments; "planner" reads the semester from /api/v1/planner/items in one stream
+CANVAS_FETCH_MODE = env("CANVAS_FETCH_MODE")
+# Where Canvas responses are kept for ETag revalidation; empty uses the default Django cache
+CANVAS_CACHE_DIR = env("CANVAS_CACHE_DIR")
+# "threads" runs imports on the blocking client; "async" uses the httpx-based AsyncSyncEngine
+SYNC_ENGINE = env("SYNC_ENGINE")
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env("DJANGO_SECRET")
 
@@ -1,38 +1,95 @@
-from django.core.management.base import BaseCommand
-from integrations.canvas import CanvasApi
-from core.models import Assignment
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from integrations.canvas import CanvasApi, hasSubmitted
+from core.models import Assignment, UserSettings
+from core.sync import canvas_response_cache
 from dateutil.parser import isoparse
 from django.utils import timezone
 
+# Fields compared and written when an existing row changes
+MIRRORED_FIELDS = ["external_id", "title", "class_name", "due_date", "has_submitted", "semester", "week", "raw_json"]
+
 
 class Command(BaseCommand):
     help = "Import assignments from Canvas into local Assignment model"
 
     def add_arguments(self, parser):
-        parser.add_argument("--canvas-key", dest="canvas_key", required=True)
-        parser.add_argument("--school-ab", dest="school_ab", required=True)
+        parser.add_argument("--user", dest="users", action="append", default=[], help="Username to import for; repeat for several users")
+        parser.add_argument("--all-users", dest="all_users", action="store_true", help="Import for every user with Canvas credentials saved")
+        parser.add_argument("--canvas-key", dest="canvas_key", required=False, help="Override the saved Canvas token (single --user only)")
+        parser.add_argument("--school-ab", dest="school_ab", required=False, help="Override the saved school domain (single --user only)")
         parser.add_argument("--timeframe", dest="timeframe", required=False, default=None)
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=500)
 
     def handle(self, *args, **options):
+        usernames = options.get("users")
+        all_users = options.get("all_users")
         canvas_key = options.get("canvas_key")
         school_ab = options.get("school_ab")
-        timeframe = options.get("timeframe")
 
-        api = CanvasApi(canvas_key, schoolAb=school_ab)
-        courses = api.get_all_courses()
-        api.set_courses_and_id()
+        if not usernames and not all_users:
+            raise CommandError("Pass --user USERNAME (repeatable) or --all-users")
+        if (canvas_key or school_ab) and (all_users or len(usernames) != 1):
+            raise CommandError("--canvas-key/--school-ab can only be used with a single --user")
+
+        settings_qs = UserSettings.objects.select_related("user")
+        if not all_users:
+            missing = set(usernames) - set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+            settings_qs = settings_qs.filter(user__username__in=usernames)
+
+        total_created = 0
+        total_updated = 0
 
+        for settings in settings_qs:
+            key = canvas_key or settings.canvas_token
+            school = school_ab or settings.school_domain
+            if not key or not school:
+                self.stderr.write(f"Skipping {settings.user}: Canvas token or school domain missing")
+                continue
+
+            try:
+                created, updated = self.import_for_user(
+                    settings, CanvasApi(key, schoolAb=school, cache=canvas_response_cache()), options.get("timeframe"), options.get("batch_size")
+                )
+            except Exception as e:
+                self.stderr.write(f"Import failed for {settings.user}: {e}")
+                continue
+
+            total_created += created
+            total_updated += updated
+            self.stdout.write(f"{settings.user}: {created} created, {updated} updated")
+
+        self.stdout.write(self.style.SUCCESS(f"Import complete: {total_created} created, {total_updated} updated"))
+
+    def import_for_user(self, settings, api, timeframe, batch_size):
+        user = settings.user
+        calendar = settings.academic_calendar()
+        # One query for every row already mirrored for this user
+        existing = {a.url: a for a in Assignment.objects.filter(user=user)}
+        seen = set()
+        to_create = []
+        to_update = []
         created = 0
         updated = 0
+        now = timezone.now()
 
-        for course in courses:
+        # Courses are streamed page by page; each course's assignments are read in full so a failing course is skipped whole
+        for course in api.iter_courses():
             course_name = course.name
-            assignments = api.get_assignment_objects(course_name, timeframe)
+            try:
+                assignments = list(api.iter_assignment_objects(course_name, timeframe))
+            except Exception as e:
+                # One unreadable course (e.g. a hidden assignments tab) shouldn't cost the user's other courses
+                self.stderr.write(f"Skipping {course_name} for {user}: {e}")
+                continue
 
             for a in assignments:
                 url = a.get("url")
-                if not url:
+                if not url or url in seen:
                     continue
+                seen.add(url)
 
                 due_at = a.get("due_at")
                 due_dt = None
@@ -42,22 +99,36 @@ class Command(BaseCommand):
                     except Exception:
                         due_dt = None
 
+                semester, week = calendar.classify(due_at)
                 defaults = {
                     "external_id": str(a.get("id")) if a.get("id") is not None else None,
                     "title": a.get("name") or "",
                     "class_name": course_name,
                     "due_date": due_dt,
-                    "has_submitted": bool(a.get("has_submitted_submissions", False)),
+                    "has_submitted": hasSubmitted(a),
+                    "semester": semester,
+                    "week": week,
                     "raw_json": a,
                 }
 
-                obj, created_flag = Assignment.objects.update_or_create(
-                    url=url, defaults=defaults
-                )
+                obj = existing.get(url)
+                if obj is None:
+                    to_create.append(Assignment(user=user, url=url, synced_at=now, **defaults))
+                elif any(getattr(obj, field) != value for field, value in defaults.items()):
+                    for field, value in defaults.items():
+                        setattr(obj, field, value)
+                    obj.synced_at = now
+                    to_update.append(obj)
 
-                if created_flag:
-                    created += 1
-                else:
-                    updated += 1
+                if len(to_create) >= batch_size:
+                    Assignment.objects.bulk_create(to_create, batch_size=batch_size)
+                    created += len(to_create)
+                    to_create = []
+                if len(to_update) >= batch_size:
+                    Assignment.objects.bulk_update(to_update, MIRRORED_FIELDS + ["synced_at"], batch_size=batch_size)
+                    updated += len(to_update)
+                    to_update = []
 
-        self.stdout.write(self.style.SUCCESS(f"Import complete: {created} created, {updated} updated"))
+        Assignment.objects.bulk_create(to_create, batch_size=batch_size)
+        Assignment.objects.bulk_update(to_update, MIRRORED_FIELDS + ["synced_at"], batch_size=batch_size)
+        return created + len(to_create), updated + len(to_update)
@@ -0,0 +1,95 @@
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.models import SyncHistory
+from core.sync import claim_import, enqueue_import, run_claimed_import, settings_with_import_credentials
+
+
+def _init_worker():
+    # Forked workers must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+def _run_job(job_id):
+    job = SyncHistory.objects.select_related("user").get(pk=job_id)
+    if not claim_import(job):
+        return job_id, "skipped"
+    run_claimed_import(job)
+    return job_id, job.status
+
+
+class Command(BaseCommand):
+    help = "Sync every user with complete credentials from Canvas into Notion"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Processes syncing users at once")
+        parser.add_argument("--per-host", dest="per_host", type=int, default=2, help="Most users synced at once against one Canvas host")
+        parser.add_argument("--shard-index", dest="shard_index", type=int, default=0)
+        parser.add_argument("--shard-count", dest="shard_count", type=int, default=1)
+        parser.add_argument("--full", action="store_true", help="Re-check every assignment instead of syncing incrementally")
+
+    def handle(self, *args, **options):
+        shard_index = options.get("shard_index")
+        shard_count = options.get("shard_count")
+        workers = max(1, options.get("workers"))
+        per_host = max(1, options.get("per_host"))
+
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise CommandError("--shard-index must be between 0 and --shard-count - 1")
+
+        # Queue one import per user in this shard, grouped by Canvas host
+        pending = defaultdict(deque)
+        for settings in settings_with_import_credentials():
+            if settings.user_id % shard_count != shard_index:
+                continue
+            job = enqueue_import(settings.user, full=options.get("full"))
+            if job.status == 'queued':
+                pending[settings.school_domain.strip().lower()].append(job.pk)
+
+        total = sum(len(jobs) for jobs in pending.values())
+        self.stdout.write(f"Shard {shard_index}/{shard_count}: {total} users across {len(pending)} hosts")
+        if not total:
+            return
+
+        # Workers open their own connections after the fork
+        connections.close_all()
+
+        running = {}
+        in_flight = defaultdict(int)
+        finished = defaultdict(int)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            while pending or running:
+                # Fill free worker slots, never exceeding the per-host cap
+                for host in list(pending):
+                    while pending[host] and in_flight[host] < per_host and len(running) < workers:
+                        future = executor.submit(_run_job, pending[host].popleft())
+                        running[future] = host
+                        in_flight[host] += 1
+                    if not pending[host]:
+                        del pending[host]
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = running.pop(future)
+                    in_flight[host] -= 1
+                    try:
+                        job_id, status = future.result()
+                    except Exception as e:
+                        self.stderr.write(f"Sync crashed for a user on {host}: {e}")
+                        finished["error"] += 1
+                        continue
+                    finished[status] += 1
+                    self.stdout.write(f"Import #{job_id} on {host}: {status}")
+
+        self.stdout.write(self.style.SUCCESS(
+            ", ".join(f"{count} {status}" for status, count in sorted(finished.items())) or "Nothing synced"
+        ))
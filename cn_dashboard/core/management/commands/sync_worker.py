@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.sync import claim_next_import, run_claimed_import
+
+
+class Command(BaseCommand):
+    help = "Run queued Canvas -> Notion imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to wait between polls of an empty queue")
+
+    def handle(self, *args, **options):
+        once = options.get("once")
+        interval = options.get("interval")
+
+        while True:
+            job = claim_next_import()
+            if job is None:
+                if once:
+                    break
+                time.sleep(interval)
+                continue
+
+            self.stdout.write(f"Running import #{job.pk} for {job.user}")
+            run_claimed_import(job)
+            self.stdout.write(self.style.SUCCESS(
+                f"Import #{job.pk} {job.status}: {job.created_count} created, {job.updated_count} updated, {job.error_count} errors"
+            ))
@@ -1,6 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
+from datetime import timezone as dt_timezone
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from integrations.scripts.select_helpers import calendar_for
 
 # Create your models here.
 class UserSettings(models.Model):
@@ -18,6 +22,176 @@ class UserSettings(models.Model):
     years_per_program = models.IntegerField(blank=True, null=True)
     semester_phase_names = models.JSONField(default=list, blank=True)
     semester_phases = models.JSONField(default=list, blank=True)
+    # Year the student matriculated and their UTC offset in hours; the integration defaults apply when unset
+    matric_year = models.IntegerField(blank=True, null=True)
+    utc_offset = models.FloatField(blank=True, null=True)
+    def academic_calendar(self):
+        """Return the compiled AcademicCalendar for the current semester settings."""
+        # calendar_for keeps compiled calendars in an in-process LRU keyed on these values, so changed
+        # settings get a new calendar and unchanged ones are a dictionary hit
+        return calendar_for(
+            (self.semester_start_date, self.semester_end_date),
+            self.semester_label,
+            self.semester_phases,
+            matric_year=self.matric_year,
+            utc_offset=self.utc_offset,
+        )
+
+
+class NotionDatabaseIndex(models.Model):
+    """Locally stored Canvas URL -> Notion page id index for one of a user's databases."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)
+    database_id = models.CharField(max_length=255, db_index=True)
+    # Pages edited on or after this were re-read from Notion on the last sync
+    last_reconciled_at = models.DateTimeField(blank=True, null=True)
+    last_synced_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = [("user", "database_id")]
+
+    def load_pages(self):
+        """Return the stored pages in the shape NotionApi.loadAssignmentIndex expects."""
+        return {
+            page.page_id: {
+                "url": page.url,
+                "key": page.assignment_key,
+                "fingerprint": page.fingerprint,
+                "last_edited_time": page.last_edited_time.isoformat() if page.last_edited_time else None,
+            }
+            for page in self.pages.all()
+        }
+
+    def store_pages(self, pages, reconciled_at=None):
+        """Replace the stored pages with NotionApi.assignmentIndexPages() output."""
+        existing = {page.page_id: page for page in self.pages.all()}
+        to_create = []
+        to_update = []
+
+        for page_id, entry in pages.items():
+            values = {
+                "url": entry.get("url"),
+                "assignment_key": entry.get("key"),
+                "fingerprint": entry.get("fingerprint") or {},
+                "last_edited_time": parse_datetime(entry["last_edited_time"]) if entry.get("last_edited_time") else None,
+            }
+            page = existing.pop(page_id, None)
+            if page is None:
+                to_create.append(NotionPageIndex(database_index=self, page_id=page_id, **values))
+            elif any(getattr(page, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(page, field, value)
+                to_update.append(page)
+
+        NotionPageIndex.objects.bulk_create(to_create, batch_size=500)
+        NotionPageIndex.objects.bulk_update(
+            to_update, ["url", "assignment_key", "fingerprint", "last_edited_time"], batch_size=500
+        )
+        if existing:
+            self.pages.filter(page_id__in=list(existing)).delete()
+
+        if reconciled_at is not None:
+            self.last_reconciled_at = reconciled_at
+        self.last_synced_at = timezone.now()
+        self.save(update_fields=["last_reconciled_at", "last_synced_at"])
+
+
+class NotionPageIndex(models.Model):
+    """One Notion page known to belong to a NotionDatabaseIndex."""
+    database_index = models.ForeignKey(NotionDatabaseIndex, on_delete=models.CASCADE, related_name="pages")
+    page_id = models.CharField(max_length=255)
+    url = models.CharField(max_length=1000, blank=True, null=True, db_index=True)
+    assignment_key = models.CharField(max_length=500, blank=True, null=True)
+    # Compared values from NotionApi, used to skip no-op updates
+    fingerprint = models.JSONField(default=dict, blank=True)
+    last_edited_time = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = [("database_index", "page_id")]
+
+
+class CanvasCourseWatermark(models.Model):
+    """Time of the last fully successful sync of one Canvas course into one Notion database."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)
+    database_id = models.CharField(max_length=255, db_index=True)
+    course_id = models.BigIntegerField()
+    last_synced_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [("user", "database_id", "course_id")]
+
+    @classmethod
+    def load_for(cls, user, database_id):
+        """Return {course_id: last_synced_at} for the user's database."""
+        return dict(
+            cls.objects.filter(user=user, database_id=database_id).values_list("course_id", "last_synced_at")
+        )
+
+    @classmethod
+    def advance(cls, user, database_id, synced_courses):
+        """Store {course_id: synced_at} from integrations.User.syncedCourses."""
+        if not synced_courses:
+            return
+        existing = {
+            mark.course_id: mark
+            for mark in cls.objects.filter(user=user, database_id=database_id, course_id__in=list(synced_courses))
+        }
+        to_create = []
+        to_update = []
+        for course_id, synced_at in synced_courses.items():
+            mark = existing.get(course_id)
+            if mark is None:
+                to_create.append(cls(user=user, database_id=database_id, course_id=course_id, last_synced_at=synced_at))
+            else:
+                mark.last_synced_at = synced_at
+                to_update.append(mark)
+        cls.objects.bulk_create(to_create)
+        cls.objects.bulk_update(to_update, ["last_synced_at"])
+
+
+class Assignment(models.Model):
+    """Local mirror of a Canvas assignment, kept up to date by the import_assignments command."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)
+    url = models.CharField(max_length=1000, db_index=True)
+    external_id = models.CharField(max_length=64, blank=True, null=True)
+    title = models.CharField(max_length=500, blank=True)
+    class_name = models.CharField(max_length=255, db_index=True)
+    due_date = models.DateTimeField(blank=True, null=True, db_index=True)
+    has_submitted = models.BooleanField(default=False)
+    # Labels from the user's academic calendar, stored so the dashboard can filter on them
+    semester = models.CharField(max_length=100, blank=True, null=True)
+    week = models.CharField(max_length=100, blank=True, null=True)
+    raw_json = models.JSONField(default=dict, blank=True)
+    synced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = [("user", "url")]
+        indexes = [
+            models.Index(fields=["user", "class_name"]),
+            models.Index(fields=["user", "due_date"]),
+            models.Index(fields=["user", "semester", "week"]),
+        ]
+
+    def __str__(self):
+        return f"{self.class_name}: {self.title}"
+
+    @classmethod
+    def reclassify_for(cls, settings, batch_size=500):
+        """Recompute Semester/Week for every mirrored assignment of the user in one batch."""
+        rows = list(cls.objects.filter(user=settings.user).only("pk", "due_date", "semester", "week"))
+        dues = [
+            row.due_date.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if row.due_date else None
+            for row in rows
+        ]
+        semesters, weeks = settings.academic_calendar().classify_many(dues)
+
+        changed = []
+        for row, semester, week in zip(rows, semesters, weeks):
+            if row.semester != semester or row.week != week:
+                row.semester = semester
+                row.week = week
+                changed.append(row)
+        cls.objects.bulk_update(changed, ["semester", "week"], batch_size=batch_size)
+        return len(changed)
 
 
 class SyncHistory(models.Model):
@@ -27,19 +201,28 @@ class SyncHistory(models.Model):
         ('import', 'Import Assignments'),
     ]
     STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
         ('success', 'Success'),
         ('error', 'Error'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)
     action = models.CharField(max_length=20, choices=ACTION_CHOICES, db_index=True)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, db_index=True)
+    # For import actions this is also when the job was queued
     created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # For queued imports: options passed to the sync, e.g. {"full": True}
+    options = models.JSONField(default=dict, blank=True)
     
     # For import actions: number of newly created assignments
     created_count = models.IntegerField(default=0)
     # For import actions: number of updated assignments
     updated_count = models.IntegerField(default=0)
+    # For import actions: number of matched assignments left alone because nothing changed
+    skipped_count = models.IntegerField(default=0)
     # For import actions: number of errors encountered
     error_count = models.IntegerField(default=0)
     
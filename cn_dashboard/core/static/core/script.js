@@ -15,7 +15,7 @@ function closeModal(id) {
     modal.style.display = 'none';
 }
 
-function handleAction(type, elem) {
+function handleAction(type, elem, full) {
     if (type === 'create') {
         const card = document.querySelector('.action-card.highlight-hover');
         // prevent duplicate requests
@@ -73,37 +73,70 @@ function handleAction(type, elem) {
             card.style.pointerEvents = 'none';
         }
 
+        const finish = () => {
+            if (card) {
+                card.dataset.busy = 'false';
+                card.classList.remove('loading');
+                card.style.pointerEvents = '';
+            }
+        };
+
+        // Sent form-encoded so the view can read full from request.POST
         fetch('/import-assignments/', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json',
+                'Content-Type': 'application/x-www-form-urlencoded',
                 'X-CSRFToken': csrftoken,
             },
-            body: JSON.stringify({}),
+            body: new URLSearchParams(full ? { full: '1' } : {}),
         })
             .then((res) => res.json())
             .then((data) => {
                 if (data.ok) {
-                    if (infoP) infoP.innerText = `Imported ${data.created} new, ${data.updated} updated`;
-                    if (card) card.querySelector('.card-icon').innerText = '✅';
+                    if (infoP) infoP.innerText = 'Import queued...';
+                    pollImport(data.job_id, card, infoP, finish);
                 } else {
                     if (infoP) infoP.innerText = 'Error: ' + (data.error || 'Unknown');
                     if (card) card.classList.add('error');
+                    finish();
                 }
             })
             .catch((err) => {
                 if (infoP) infoP.innerText = 'Network error while syncing assignments.';
-            })
-            .finally(() => {
-                if (card) {
-                    card.dataset.busy = 'false';
-                    card.classList.remove('loading');
-                    card.style.pointerEvents = '';
-                }
+                finish();
             });
     }
 }
 
+// Polls a queued import until the worker has finished it
+function pollImport(jobId, card, infoP, finish) {
+    fetch(`/import-status/${jobId}/`)
+        .then((res) => res.json())
+        .then((data) => {
+            if (!data.ok) {
+                if (infoP) infoP.innerText = 'Error: ' + (data.error || 'Unknown');
+                if (card) card.classList.add('error');
+                finish();
+            } else if (data.status === 'queued' || data.status === 'running') {
+                if (infoP) infoP.innerText = data.status === 'queued' ? 'Import queued...' : 'Syncing with Canvas...';
+                setTimeout(() => pollImport(jobId, card, infoP, finish), 2000);
+            } else if (data.status === 'success') {
+                if (infoP) infoP.innerText = `Imported ${data.created} new, ${data.updated} updated, ${data.skipped || 0} unchanged`;
+                if (card) card.querySelector('.card-icon').innerText = '✅';
+                finish();
+            } else {
+                const first = (data.error_messages || [])[0];
+                if (infoP) infoP.innerText = 'Error: ' + (typeof first === 'string' ? first : `${data.errors} errors`);
+                if (card) card.classList.add('error');
+                finish();
+            }
+        })
+        .catch((err) => {
+            if (infoP) infoP.innerText = 'Network error while checking import status.';
+            finish();
+        });
+}
+
 function getCookie(name) {
     let cookieValue = null;
     if (document.cookie && document.cookie !== '') {
@@ -0,0 +1,220 @@
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import UserSettings, SyncHistory, NotionDatabaseIndex, CanvasCourseWatermark
+
+from integrations.async_sync import AsyncSyncEngine
+from integrations.http_cache import DiskStore
+from integrations.user import User as IntegrationUser
+
+
+def canvas_response_cache():
+    """Store for Canvas conditional GETs: a directory when CANVAS_CACHE_DIR is set, otherwise the Django cache."""
+    if django_settings.CANVAS_CACHE_DIR:
+        return DiskStore(django_settings.CANVAS_CACHE_DIR)
+    return cache
+
+
+def has_import_credentials(settings):
+    return bool(settings.canvas_token and settings.school_domain and settings.notion_token and settings.notion_page_id)
+
+
+def settings_with_import_credentials():
+    """UserSettings rows that have everything an import needs."""
+    return UserSettings.objects.select_related("user").exclude(canvas_token="").exclude(
+        school_domain=""
+    ).exclude(notion_token="").exclude(notion_page_id="").exclude(notion_page_id__isnull=True)
+
+
+# A running import whose worker died (killed, OOM, redeploy) is given up on after this long
+STALE_IMPORT_AFTER = timedelta(hours=1)
+
+
+def fail_stale_imports(user=None):
+    """Mark imports stuck in running for longer than STALE_IMPORT_AFTER as failed; returns how many."""
+    now = timezone.now()
+    stale = SyncHistory.objects.filter(
+        action='import', status='running', started_at__lt=now - STALE_IMPORT_AFTER
+    )
+    if user is not None:
+        stale = stale.filter(user=user)
+    return stale.update(
+        status='error',
+        finished_at=now,
+        error_count=1,
+        error_messages=["Import was interrupted before it finished"],
+    )
+
+
+def enqueue_import(user, full=False):
+    """Queue an import for the user, reusing one that is already queued or running."""
+    # A stuck job would otherwise be handed back on every request and block the user forever
+    fail_stale_imports(user)
+    pending = SyncHistory.objects.filter(
+        user=user, action='import', status__in=['queued', 'running']
+    ).first()
+    if pending is not None:
+        return pending
+
+    return SyncHistory.objects.create(
+        user=user,
+        action='import',
+        status='queued',
+        options={"full": bool(full)},
+    )
+
+
+def claim_import(job):
+    """Move a queued import to running; False if another worker got to it first."""
+    # Only one worker wins the queued -> running transition for a given row
+    claimed = SyncHistory.objects.filter(pk=job.pk, status='queued').update(
+        status='running', started_at=timezone.now()
+    )
+    if claimed:
+        job.refresh_from_db()
+    return bool(claimed)
+
+
+def claim_next_import():
+    """Mark the oldest queued import as running and return it, or None if the queue is empty."""
+    fail_stale_imports()
+    while True:
+        job = SyncHistory.objects.filter(action='import', status='queued').order_by('created_at').first()
+        if job is None:
+            return None
+        if claim_import(job):
+            return job
+
+
+def run_import(job):
+    """Run the Canvas -> Notion sync for a claimed import job and record the outcome on it."""
+    try:
+        integrator = _prepare_import(job)
+        if integrator is None:
+            return job
+
+        courses = integrator.getAllCourses()
+        # This will create DB if needed and upsert new/existing assignments into Notion
+        result = integrator.enterAssignmentsToNotionDb(courses, full=_is_full(job))
+        _complete_import(job, integrator, result)
+    except Exception as e:
+        _finish(job, 'error', error_count=1, error_messages=[str(e)])
+
+    return job
+
+
+async def run_import_async(job):
+    """Same as run_import, but the sync runs on AsyncSyncEngine so it can be awaited from async code."""
+    try:
+        integrator = await sync_to_async(_prepare_import)(job)
+        if integrator is None:
+            return job
+
+        courses = await asyncio.to_thread(integrator.getAllCourses)
+        result = await AsyncSyncEngine(integrator).enterAssignmentsToNotionDb(courses, full=_is_full(job))
+        await sync_to_async(_complete_import)(job, integrator, result)
+    except Exception as e:
+        await sync_to_async(_finish)(job, 'error', error_count=1, error_messages=[str(e)])
+
+    return job
+
+
+def run_claimed_import(job):
+    """Run a claimed job on the engine picked by the SYNC_ENGINE setting."""
+    if django_settings.SYNC_ENGINE == "async":
+        return asyncio.run(run_import_async(job))
+    return run_import(job)
+
+
+def _is_full(job):
+    # A full sync re-checks every assignment instead of only those updated since the last run
+    return bool((job.options or {}).get("full"))
+
+
+def _prepare_import(job):
+    """Build the integration User for a job, or finish the job and return None if credentials are missing."""
+    settings, created = UserSettings.objects.get_or_create(user=job.user)
+
+    if not has_import_credentials(settings):
+        _finish(job, 'error', error_count=1, error_messages=["Missing Canvas/Notion credentials or page id"])
+        return None
+
+    # Prefer an explicit notion_database_id (most recently created DB) if available
+    db_id = settings.notion_database_id if settings.notion_database_id else None
+
+    assignment_index = None
+    course_watermarks = None
+    if db_id:
+        db_index, _ = NotionDatabaseIndex.objects.get_or_create(user=job.user, database_id=db_id)
+        assignment_index = {"pages": db_index.load_pages(), "since": db_index.last_reconciled_at}
+        course_watermarks = CanvasCourseWatermark.load_for(job.user, db_id)
+
+    return IntegrationUser(
+        settings.canvas_token,
+        settings.notion_token,
+        settings.notion_page_id,
+        settings.school_domain,
+        database_id=db_id,
+        db_properties=settings.db_properties,
+        semester_start_date=settings.semester_start_date,
+        semester_end_date=settings.semester_end_date,
+        semester_label=settings.semester_label,
+        semester_phases=settings.semester_phases,
+        assignment_index=assignment_index,
+        course_watermarks=course_watermarks,
+        calendar=settings.academic_calendar(),
+        canvas_backend=django_settings.CANVAS_BACKEND,
+        fetch_mode=django_settings.CANVAS_FETCH_MODE,
+        canvas_cache=canvas_response_cache(),
+    )
+
+
+def _complete_import(job, integrator, result):
+    """Persist the sync state a finished run produced and record its outcome on the job."""
+    # Persist the page index so the next sync only reconciles recently edited pages
+    notion_profile = integrator.notionProfile
+    if notion_profile.database_id:
+        db_index, _ = NotionDatabaseIndex.objects.get_or_create(
+            user=job.user, database_id=notion_profile.database_id
+        )
+        db_index.store_pages(notion_profile.assignmentIndexPages(), notion_profile.indexReconciledAt)
+        CanvasCourseWatermark.advance(job.user, notion_profile.database_id, integrator.syncedCourses)
+
+    created_count = result.get('created', 0) if isinstance(result, dict) else 0
+    updated_count = result.get('updated', 0) if isinstance(result, dict) else 0
+    skipped_count = result.get('skipped', 0) if isinstance(result, dict) else 0
+    errors = result.get('errors', []) if isinstance(result, dict) else []
+
+    # Determine status: error if only errors, success if no errors, error if all failed
+    has_successes = created_count > 0 or updated_count > 0
+    has_errors = len(errors) > 0
+
+    if has_errors and not has_successes:
+        status = 'error'
+    else:
+        status = 'success' if not has_errors else 'error'
+
+    _finish(
+        job,
+        status,
+        created_count=created_count,
+        updated_count=updated_count,
+        skipped_count=skipped_count,
+        error_count=len(errors),
+        error_messages=errors[:10],
+    )
+
+
+def _finish(job, status, **fields):
+    job.status = status
+    job.finished_at = timezone.now()
+    if job.started_at is None:
+        job.started_at = job.finished_at
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save()
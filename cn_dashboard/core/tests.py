@@ -1,3 +1,94 @@
+from datetime import timedelta
+from io import StringIO
+
+import requests
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
+
+from integrations.canvas import Class
+
+from .management.commands.import_assignments import Command as ImportAssignmentsCommand
+from .models import Assignment, SyncHistory, UserSettings
+from .sync import STALE_IMPORT_AFTER, claim_next_import, enqueue_import
+
+class ImportQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="student", password="pw")
+
+    def running_job(self, started_ago):
+        return SyncHistory.objects.create(
+            user=self.user, action='import', status='running', started_at=timezone.now() - started_ago
+        )
+
+    def test_enqueue_reuses_live_running_job(self):
+        job = self.running_job(timedelta(minutes=5))
+        self.assertEqual(enqueue_import(self.user).pk, job.pk)
+
+    def test_enqueue_replaces_stale_running_job(self):
+        stuck = self.running_job(STALE_IMPORT_AFTER + timedelta(minutes=1))
+
+        job = enqueue_import(self.user)
+
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'error')
+        self.assertNotEqual(job.pk, stuck.pk)
+        self.assertEqual(job.status, 'queued')
+
+    def test_claim_fails_stale_jobs(self):
+        stuck = self.running_job(STALE_IMPORT_AFTER + timedelta(minutes=1))
+
+        self.assertIsNone(claim_next_import())
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'error')
+        self.assertIsNotNone(stuck.finished_at)
+
+
+class ImportViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="student", password="pw")
+        UserSettings.objects.create(
+            user=self.user, canvas_token="canvas", school_domain="canvas.test", notion_token="notion", notion_page_id="page"
+        )
+        self.client.force_login(self.user)
+
+    def test_full_resync_is_queued_as_full(self):
+        res = self.client.post("/import-assignments/", {"full": "1"})
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(SyncHistory.objects.get(pk=res.json()["job_id"]).options, {"full": True})
+
+    def test_plain_import_is_incremental(self):
+        res = self.client.post("/import-assignments/")
+        self.assertEqual(SyncHistory.objects.get(pk=res.json()["job_id"]).options, {"full": False})
+
+
+# Canvas client double whose assignment listing fails for the courses named in forbidden
+class FakeCanvas:
+    def __init__(self, courses, forbidden=()):
+        self.courses = courses
+        self.forbidden = forbidden
+
+    def iter_courses(self):
+        for name in self.courses:
+            yield Class(len(name), name)
+
+    def iter_assignment_objects(self, courseName, timeframe=None):
+        if courseName in self.forbidden:
+            raise requests.HTTPError("403 Client Error: Forbidden")
+        yield {"id": 1, "name": "Essay", "url": f"https://canvas.test/{courseName}/1", "due_at": None}
+
+
+class ImportAssignmentsCommandTests(TestCase):
+    def test_failing_course_is_skipped_and_batch_still_flushed(self):
+        user = User.objects.create_user(username="student", password="pw")
+        settings = UserSettings.objects.create(user=user)
+        command = ImportAssignmentsCommand(stdout=StringIO(), stderr=StringIO())
+
+        created, updated = command.import_for_user(
+            settings, FakeCanvas(["CS1010", "CS2030", "MA1521"], forbidden={"CS2030"}), None, 500
+        )
 
-# Create your tests here.
+        self.assertEqual((created, updated), (2, 0))
+        self.assertEqual(set(Assignment.objects.values_list("class_name", flat=True)), {"CS1010", "MA1521"})
+        self.assertIn("CS2030", command.stderr.getvalue())
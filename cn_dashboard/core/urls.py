@@ -10,7 +10,9 @@ urlpatterns = [
     path("save-db-settings/", views.save_db_settings, name="save_db_settings"),
     path("create-database/", integrations_views.create_database, name="create_database"),
     path("import-assignments/", views.import_assignments, name="import_assignments"),
+    path("import-status/<int:job_id>/", views.import_status, name="import_status"),
     path("sync-history/", views.sync_history, name="sync_history"),
+    path("assignments/", views.assignments, name="assignments"),
     path("settings/", views.settings, name="settings"),
     path("settings/change-username/", views.change_username, name="change_username"),
     path("settings/save-preferences/", views.save_preferences, name="save_preferences"),
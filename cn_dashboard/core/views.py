@@ -2,9 +2,12 @@ from django.shortcuts import render, redirect
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import update_session_auth_hash, logout as auth_logout
-from .models import UserSettings, SyncHistory
-
-from integrations.user import User as IntegrationUser
+from datetime import date, datetime, time, timedelta
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import UserSettings, SyncHistory, CanvasCourseWatermark, Assignment
+from .sync import enqueue_import, has_import_credentials
 
 def landing(request):
     if request.user.is_authenticated:
@@ -52,12 +55,8 @@ def import_assignments(request):
     if request.method != 'POST':
         return JsonResponse({"ok": False, "error": "POST required"}, status=400)
     settings, created = UserSettings.objects.get_or_create(user=request.user)
-    canvas_token = settings.canvas_token
-    notion_token = settings.notion_token
-    notion_page_id = settings.notion_page_id
-    school_domain = settings.school_domain
 
-    if not canvas_token or not school_domain or not notion_token or not notion_page_id:
+    if not has_import_credentials(settings):
         SyncHistory.objects.create(
             user=request.user,
             action='import',
@@ -66,67 +65,32 @@ def import_assignments(request):
         )
         return JsonResponse({"ok": False, "error": "Missing Canvas/Notion credentials or page id"}, status=400)
 
-    # Prefer an explicit notion_database_id (most recently created DB) if available
-    db_id = settings.notion_database_id if settings.notion_database_id else None
-
-    try:
-        integrator = IntegrationUser(
-            canvas_token,
-            notion_token,
-            notion_page_id,
-            school_domain,
-            database_id=db_id,
-            db_properties=settings.db_properties,
-            semester_start_date=settings.semester_start_date,
-            semester_end_date=settings.semester_end_date,
-            semester_label=settings.semester_label,
-            semester_phases=settings.semester_phases,
-        )
-
-        courses = integrator.getAllCourses()
-        # This will create DB if needed and upsert new/existing assignments into Notion
-        result = integrator.enterAssignmentsToNotionDb(courses)
+    # The sync itself runs in the sync_worker command; poll import_status for the outcome
+    full = request.POST.get("full") == "1"
+    job = enqueue_import(request.user, full=full)
+    return JsonResponse({"ok": True, "job_id": job.pk, "status": job.status}, status=202)
 
-        created_count = result.get('created', 0) if isinstance(result, dict) else 0
-        updated_count = result.get('updated', 0) if isinstance(result, dict) else 0
-        errors = result.get('errors', []) if isinstance(result, dict) else []
-
-        # Determine status: error if only errors, success if no errors, error if all failed
-        has_successes = created_count > 0 or updated_count > 0
-        has_errors = len(errors) > 0
-        
-        if has_errors and not has_successes:
-            status = 'error'
-        else:
-            status = 'success' if not has_errors else 'error'
-
-        # Log result
-        SyncHistory.objects.create(
-            user=request.user,
-            action='import',
-            status=status,
-            created_count=created_count,
-            updated_count=updated_count,
-            error_count=len(errors),
-            error_messages=errors[:10]
-        )
 
-        return JsonResponse({
-            "ok": True,
-            "created": created_count,
-            "updated": updated_count,
-            "errors": len(errors),
-            "error_messages": errors[:10],
-        })
-    except Exception as e:
-        SyncHistory.objects.create(
-            user=request.user,
-            action='import',
-            status='error',
-            error_count=1,
-            error_messages=[str(e)]
-        )
-        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+@login_required
+def import_status(request, job_id):
+    """Report the state of one of the current user's queued imports."""
+    job = SyncHistory.objects.filter(user=request.user, action='import', pk=job_id).first()
+    if job is None:
+        return JsonResponse({"ok": False, "error": "Import not found"}, status=404)
+
+    return JsonResponse({
+        "ok": True,
+        "job_id": job.pk,
+        "status": job.status,
+        "created": job.created_count,
+        "updated": job.updated_count,
+        "skipped": job.skipped_count,
+        "errors": job.error_count,
+        "error_messages": job.error_messages,
+        "queued_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    })
 
 
 @login_required
@@ -135,6 +99,89 @@ def sync_history(request):
     records = SyncHistory.objects.filter(user=request.user)[:50]
     return render(request, "core/sync-history.html", {'records': records})
 
+ASSIGNMENTS_PAGE_SIZE = 50
+
+
+@login_required
+def assignments(request):
+    """List the user's mirrored assignments with filters and keyset pagination on (due_date, id)."""
+    rows = Assignment.objects.filter(user=request.user)
+
+    class_name = request.GET.get("class") or ""
+    semester = request.GET.get("semester") or ""
+    week = request.GET.get("week") or ""
+    due_from = _parse_filter_date(request.GET.get("due_from"))
+    due_to = _parse_filter_date(request.GET.get("due_to"))
+
+    if class_name:
+        rows = rows.filter(class_name=class_name)
+    if semester:
+        rows = rows.filter(semester=semester)
+    if week:
+        rows = rows.filter(week=week)
+    if due_from:
+        rows = rows.filter(due_date__gte=timezone.make_aware(datetime.combine(due_from, time.min)))
+    if due_to:
+        rows = rows.filter(due_date__lt=timezone.make_aware(datetime.combine(due_to + timedelta(days=1), time.min)))
+
+    # The cursor is "<due_date iso or none>|<id>" of the last row on the previous page
+    after = request.GET.get("after") or ""
+    if "|" in after:
+        after_due_raw, after_id_raw = after.rsplit("|", 1)
+        after_due = parse_datetime(after_due_raw) if after_due_raw != "none" else None
+        try:
+            after_id = int(after_id_raw)
+        except ValueError:
+            after_id = None
+        if after_id is not None:
+            if after_due is None:
+                rows = rows.filter(due_date__isnull=True, id__gt=after_id)
+            else:
+                rows = rows.filter(
+                    Q(due_date__gt=after_due)
+                    | Q(due_date=after_due, id__gt=after_id)
+                    | Q(due_date__isnull=True)
+                )
+
+    rows = rows.order_by(F("due_date").asc(nulls_last=True), "id").only(
+        "id", "title", "url", "class_name", "due_date", "has_submitted", "semester", "week"
+    )
+    page = list(rows[:ASSIGNMENTS_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(page) > ASSIGNMENTS_PAGE_SIZE:
+        page = page[:ASSIGNMENTS_PAGE_SIZE]
+        last = page[-1]
+        next_cursor = f"{last.due_date.isoformat() if last.due_date else 'none'}|{last.id}"
+
+    # Filter options come straight from the (user, ...) indexes
+    options = Assignment.objects.filter(user=request.user)
+    filters = request.GET.copy()
+    filters.pop("after", None)
+
+    return render(request, "core/assignments.html", {
+        "assignments": page,
+        "next_cursor": next_cursor,
+        "filters": filters.urlencode(),
+        "selected": {
+            "class": class_name,
+            "semester": semester,
+            "week": week,
+            "due_from": due_from.isoformat() if due_from else "",
+            "due_to": due_to.isoformat() if due_to else "",
+        },
+        "class_options": options.order_by("class_name").values_list("class_name", flat=True).distinct(),
+        "semester_options": options.exclude(semester__isnull=True).order_by("semester").values_list("semester", flat=True).distinct(),
+        "week_options": options.exclude(week__isnull=True).order_by("week").values_list("week", flat=True).distinct(),
+    })
+
+
+def _parse_filter_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
 @login_required
 def settings(request):
     """Display settings page for the current user."""
@@ -185,6 +232,8 @@ def save_semester_bounds(request):
     label = (request.POST.get("semester_label") or "").strip() or None
     semesters_per_year_raw = request.POST.get("semesters_per_year") or None
     years_per_program_raw = request.POST.get("years_per_program") or None
+    matric_year_raw = request.POST.get("matric_year") or None
+    utc_offset_raw = request.POST.get("utc_offset") or None
     phase_names_raw = request.POST.get("semester_phase_names") or ""
     phase_names = request.POST.getlist("phase_name")
     phase_starts = request.POST.getlist("phase_start")
@@ -244,6 +293,24 @@ def save_semester_bounds(request):
         if years_per_program <= 0:
             return _render_settings_with_semester_error(request, "Years per program must be greater than 0.")
 
+    matric_year = None
+    utc_offset = None
+    if matric_year_raw:
+        try:
+            matric_year = int(matric_year_raw)
+        except ValueError:
+            return _render_settings_with_semester_error(request, "Matriculation year must be a number.")
+        if matric_year < 1900 or matric_year > 2200:
+            return _render_settings_with_semester_error(request, "Matriculation year looks wrong.")
+
+    if utc_offset_raw:
+        try:
+            utc_offset = float(utc_offset_raw)
+        except ValueError:
+            return _render_settings_with_semester_error(request, "UTC offset must be a number of hours.")
+        if utc_offset < -12 or utc_offset > 14:
+            return _render_settings_with_semester_error(request, "UTC offset must be between -12 and 14 hours.")
+
     phase_names = [p.strip() for p in phase_names_raw.split(",") if p.strip()]
 
     settings.semester_start_date = start_date if not phases else None
@@ -253,7 +320,13 @@ def save_semester_bounds(request):
     settings.years_per_program = years_per_program
     settings.semester_phase_names = phase_names
     settings.semester_phases = phases
+    settings.matric_year = matric_year
+    settings.utc_offset = utc_offset
     settings.save()
+    # Relabel the local mirror with the new calendar
+    Assignment.reclassify_for(settings)
+    # Week/Semester labels may have moved, so the next import has to look at every assignment again
+    CanvasCourseWatermark.objects.filter(user=request.user).delete()
     return redirect("core:settings")
 
 
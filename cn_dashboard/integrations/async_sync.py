@@ -0,0 +1,180 @@
+import asyncio, json
+from datetime import datetime, timezone
+from .canvas import CanvasApi, normalizeAssignment
+from .ratelimit import MAX_RETRIES, RETRY_STATUSES, is_canvas_throttled, retry_delay
+from .session import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+try:
+    import httpx
+except ImportError:  # httpx is only needed for the async engine
+    httpx = None
+
+# Requests in flight at once per service within one sync
+DEFAULT_CANVAS_CONCURRENCY = 4
+DEFAULT_NOTION_CONCURRENCY = 3
+
+
+# Runs a User's sync as coroutines: Canvas reads and Notion writes go through one httpx.AsyncClient, each service
+# capped by its own semaphore. Planning and the Notion index stay on the User, so the result matches
+# User.enterAssignmentsToNotionDb; only the network calls move off the calling thread
+class AsyncSyncEngine:
+    def __init__(
+        self,
+        user,
+        canvas_concurrency=DEFAULT_CANVAS_CONCURRENCY,
+        notion_concurrency=DEFAULT_NOTION_CONCURRENCY,
+        client=None,
+    ):
+        if httpx is None:
+            raise ImportError("The async sync engine requires httpx (pip install httpx)")
+        self.user = user
+        self.client = client
+        self.canvasSemaphore = asyncio.Semaphore(max(1, canvas_concurrency))
+        self.notionSemaphore = asyncio.Semaphore(max(1, notion_concurrency))
+
+    async def enterAssignmentsToNotionDb(self, courseList, timeframe=None, full=False):
+        if self.client is not None:
+            return await self._sync(courseList, timeframe, full)
+
+        timeout = httpx.Timeout(DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            self.client = client
+            try:
+                return await self._sync(courseList, timeframe, full)
+            finally:
+                self.client = None
+
+    async def _sync(self, courseList, timeframe, full):
+        user = self.user
+        # Database checks and index reconciliation are one-off blocking calls, so they run in a thread
+        watermarks = await asyncio.to_thread(user.prepareDatabase, full)
+
+        syncStartedAt = datetime.now(timezone.utc)
+        plan = await asyncio.to_thread(user.startPlan, courseList, watermarks)
+
+        for course, assignments, error in await self.fetchCourseAssignments(plan["courses"], timeframe):
+            user.planCourseAssignments(plan, course, assignments, error, watermarks)
+
+        created, updated, errors = await self.executeUpsertPlan(plan)
+        return user.finishSync(plan, created, updated, errors, syncStartedAt)
+
+    # [(course, assignments, error)] in courseList order, every course fetched concurrently
+    async def fetchCourseAssignments(self, courseList, timeframe=None):
+        user = self.user
+        # Planner and GraphQL fetches are a handful of requests already; run them as-is off the loop
+        if user.fetch_mode != "courses" or type(user.canvasProfile) is not CanvasApi:
+            return await asyncio.to_thread(lambda: list(user.fetchCourseAssignments(courseList, timeframe)))
+
+        return await asyncio.gather(*(self._fetchCourse(course, timeframe) for course in courseList))
+
+    async def _fetchCourse(self, course, timeframe=None):
+        try:
+            assignments = []
+            async for page in self._paginateCanvas(*self.user.canvasProfile.assignment_list_request(course.name, timeframe)):
+                assignments.extend(normalizeAssignment(assignment) for assignment in page)
+            return course, assignments, None
+        except Exception as e:
+            return course, [], {"action": "fetch", "course": course.name, "error": str(e)}
+
+    # Async twin of CanvasApi._paginate, sharing its response cache
+    async def _paginateCanvas(self, readUrl, params=None):
+        canvas = self.user.canvasProfile
+        # Unlike requests, httpx would send None values as empty parameters
+        params = {k: v for k, v in (params or {}).items() if v is not None} or None
+        while readUrl:
+            # The cache store may be blocking (Django's database or file caches), so keep it off the loop
+            entry = await asyncio.to_thread(canvas.responseCache.lookup, readUrl, params) if canvas.responseCache else None
+            headers = dict(canvas.header)
+            if entry is not None:
+                headers.update(canvas.responseCache.conditionalHeaders(entry))
+
+            res = await self._canvasRequest("GET", readUrl, headers=headers, params=params)
+
+            if res.status_code == 304 and entry is not None:
+                page, nextUrl = entry["payload"], entry.get("next")
+            else:
+                res.raise_for_status()
+                page = res.json()
+                nextUrl = res.links.get("next", {}).get("url")
+                if canvas.responseCache is not None:
+                    await asyncio.to_thread(canvas.responseCache.remember, readUrl, params, res, page)
+
+            if not isinstance(page, list):
+                return
+
+            yield page
+            readUrl = nextUrl
+            params = None
+
+    async def _canvasRequest(self, method, url, **kwargs):
+        limiter = self.user.canvasProfile.rateLimiter
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.canvasSemaphore:
+                # Same per-host limiter as the blocking client, so every sync against this school shares one budget
+                while (wait := limiter.try_acquire()) > 0:
+                    await asyncio.sleep(wait)
+                res = None
+                try:
+                    res = await self.client.request(method, url, **kwargs)
+                finally:
+                    limiter.release(res)
+
+            if not is_canvas_throttled(res) or attempt == MAX_RETRIES:
+                return res
+            limiter.pause(retry_delay(res, attempt))
+        return res
+
+    async def _notionRequest(self, method, url, **kwargs):
+        bucket = self.user.notionProfile.rateLimiter
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.notionSemaphore:
+                # Same token bucket as the blocking client, so both respect one Notion budget
+                while (wait := bucket.try_acquire()) > 0:
+                    await asyncio.sleep(wait)
+                res = await self.client.request(method, url, **kwargs)
+
+            if res.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return res
+
+            delay = retry_delay(res, attempt)
+            if res.status_code == 429:
+                bucket.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+        return res
+
+    # Same contract as User.executeUpsertPlan: returns (created, updated, errors)
+    async def executeUpsertPlan(self, plan):
+        errors = list(plan.get("errors", []))
+        createErrors = await asyncio.gather(*(self._writeItem("create", item) for item in plan.get("create", [])))
+        updateErrors = await asyncio.gather(*(self._writeItem("update", item) for item in plan.get("update", [])))
+
+        created = createErrors.count(None)
+        updated = updateErrors.count(None)
+        errors.extend(error for error in createErrors + updateErrors if error is not None)
+        return created, updated, errors
+
+    # Creates or updates the Notion page for a planned item, returning an error dict on failure
+    async def _writeItem(self, action, item):
+        notion = self.user.notionProfile
+        fields = self.user._itemFields(item)
+        assignment = item["assignment"]
+        try:
+            if action == "create":
+                res = await self._notionRequest(
+                    "POST", "https://api.notion.com/v1/pages",
+                    headers=notion.notionHeaders, content=json.dumps(notion.newPageData(**fields)),
+                )
+                notion._record_write(res)
+            else:
+                res = await self._notionRequest(
+                    "PATCH", f"https://api.notion.com/v1/pages/{item['page_id']}",
+                    headers=notion.notionHeaders, content=json.dumps(notion.updatePageData(**fields)),
+                )
+                notion._record_write(res, item["page_id"])
+
+            if 200 <= res.status_code < 300:
+                return None
+            return {"action": action, "course": item["course"], "url": assignment.get("url"), "response": res.text}
+        except Exception as e:
+            return {"action": action, "course": item["course"], "url": assignment.get("url"), "error": str(e)}
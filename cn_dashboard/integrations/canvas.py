@@ -1,148 +1,209 @@
 import requests, json
-from datetime import date
+from .ratelimit import MAX_RETRIES, is_canvas_throttled, limiter_for, retry_delay
+from .http_cache import ResponseCache
+from .session import build_session
+from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 from requests.auth import HTTPBasicAuth
 
+# Canvas silently caps per_page at 100, anything beyond that comes through Link-header pagination
+PER_PAGE = 100
+# Submission workflow states that mean the student has handed the work in. "graded" is left out: Canvas also
+# uses it for missing work a teacher scored, so graded work only counts once it has a submitted_at
+SUBMITTED_STATES = ("submitted", "pending_review")
+
 
 class Class:
-    def __init__(self, id=None, name=None, term_id=None, assignments=None):
+    def __init__(self, id=None, name=None, term_id=None, assignments=None, concluded=False):
         self.id = id
         self.name = name
         self.assignments = []
         self.term_id = term_id
+        self.concluded = concluded
 
 
 # Class implementation of canvas API
 class CanvasApi:
-    def __init__(self, canvasKey, schoolAb=""):
+    def __init__(self, canvasKey, schoolAb="", session=None, cache=None):
         self.canvasKey = canvasKey
+        self.session = session or build_session()
+        # Optional Django-style cache (or DiskStore) for conditional GETs, scoped to this token
+        self.responseCache = ResponseCache(cache, canvasKey) if cache is not None else None
         self.schoolAb = schoolAb
         self.header = {"Authorization": "Bearer " + self.canvasKey}
         self.courses = {}
-
-    def get_courses_within_six_months(self):
+        # Shared by every client talking to the same school, so its parallelism adapts to Canvas' budget
+        self.rateLimiter = limiter_for(schoolAb)
+
+    # Sends a request through the host limiter, backing off and retrying when Canvas throttles with a 403
+    def _request(self, method, url, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self.rateLimiter.acquire()
+            res = None
+            try:
+                res = self.session.request(method, url, **kwargs)
+            finally:
+                self.rateLimiter.release(res)
+
+            if not is_canvas_throttled(res) or attempt == MAX_RETRIES:
+                return res
+            self.rateLimiter.pause(retry_delay(res, attempt))
+        return res
+
+    # Yields each page of a Canvas list endpoint, following the Link: rel="next" header until exhausted
+    def _paginate(self, readUrl, params=None):
+        while readUrl:
+            page, nextUrl = self._get_page(readUrl, params)
+
+            if not isinstance(page, list):
+                return
+
+            yield page
+
+            # The next link already carries the full query string
+            readUrl = nextUrl
+            params = None
+
+    # Returns (parsed JSON, next page url) for one GET, answering 304s from the response cache
+    def _get_page(self, readUrl, params=None):
+        if self.responseCache is None:
+            res = self._request("GET", readUrl, headers=self.header, params=params)
+            res.raise_for_status()
+            return res.json(), res.links.get("next", {}).get("url")
+
+        entry = self.responseCache.lookup(readUrl, params)
+        headers = {**self.header, **self.responseCache.conditionalHeaders(entry)}
+        res = self._request("GET", readUrl, headers=headers, params=params)
+
+        if res.status_code == 304 and entry is not None:
+            return entry["payload"], entry.get("next")
+
+        res.raise_for_status()
+        entry = self.responseCache.remember(readUrl, params, res, res.json())
+        return entry["payload"], entry["next"]
+
+    # Yields pages of raw course dicts for every course the user is enrolled in
+    def iter_course_pages(self):
         params = {
-            "per_page": 200,
+            "per_page": PER_PAGE,
             "include": ["concluded"],
             "enrollment_state": ["active"],
         }
         readUrl = f"https://{self.schoolAb}/api/v1/courses"
-        classes = []
-        courses = requests.request(
-            "GET", readUrl, headers=self.header, params=params
-        ).json()
-
-        for course in courses:
-            startDate = ""
-            ndx = 0
-
-            if course.get("start_at") == None:
-                continue
+        yield from self._paginate(readUrl, params)
 
-            while course.get("start_at")[ndx] != "T":
-                startDate += course.get("start_at")[ndx]
-                ndx += 1
-
-            classStartDate = date.fromisoformat(startDate)
-            sixMonthsAgo = date.today() - relativedelta(months=6)
-
-            if classStartDate < sixMonthsAgo:
-                continue
-
-            if course.get("name") != None:
-                name = course.get("name")
-                name = cleanCourseName(name)
+    # Yields a Class object per named course, registering its id in self.courses on the way
+    def iter_courses(self):
+        for page in self.iter_course_pages():
+            for course in page:
+                if course.get("name") == None:
+                    continue
 
+                name = cleanCourseName(course.get("name"))
                 classObj = Class(
                     course.get("id"),
                     name,
                     course.get("enrollment_term_id"),
                     course.get("assignments"),
+                    bool(course.get("concluded")),
                 )
+                self.courses[classObj.name] = classObj.id
+                yield classObj
 
-                classes.append(classObj)
+    # Yields courses that started within the past 6 months
+    def iter_courses_within_six_months(self):
+        sixMonthsAgo = date.today() - relativedelta(months=6)
 
-        return classes
+        for page in self.iter_course_pages():
+            for course in page:
+                startAt = course.get("start_at")
 
-    def get_all_courses(self):
-        params = {
-            "per_page": 200,
-            "include": ["concluded"],
-            "enrollment_state": ["active"],
-        }
-        readUrl = f"https://{self.schoolAb}/api/v1/courses"
-        classes = []
-        courses = requests.request(
-            "GET", readUrl, headers=self.header, params=params
-        ).json()
+                if startAt == None or course.get("name") == None:
+                    continue
 
-        for i in courses:
-            if i.get("name") != None:
-                name = i.get("name")
-                name = cleanCourseName(name)
+                classStartDate = date.fromisoformat(startAt.split("T")[0])
 
+                if classStartDate < sixMonthsAgo:
+                    continue
+
+                name = cleanCourseName(course.get("name"))
                 classObj = Class(
-                    i.get("id"),
+                    course.get("id"),
                     name,
-                    i.get("enrollment_term_id"),
-                    i.get("assignments"),
+                    course.get("enrollment_term_id"),
+                    course.get("assignments"),
+                    bool(course.get("concluded")),
                 )
-                classes.append(classObj)
-        return classes
+                self.courses[classObj.name] = classObj.id
+                yield classObj
+
+    def get_courses_within_six_months(self):
+        return list(self.iter_courses_within_six_months())
+
+    def get_all_courses(self):
+        return list(self.iter_courses())
 
     # Initialize self.courses dictionary with the key being
     def set_courses_and_id(self):
-        for courseObject in self.get_all_courses():
-            if courseObject != None:
-                self.courses[courseObject.name] = courseObject.id
+        for _ in self.iter_courses():
+            pass
 
     # Return a courses id number given the courses name
     def get_course_id(self, courseName):
         return self.courses[courseName]
 
-    # Returns a list of all assignment objects for a given course
-    def get_assignment_objects(self, courseName, timeframe=None):
-        readUrl = f"https://{self.schoolAb}/api/v1/courses/{self.courses[courseName]}/assignments/"
-        params = {"per_page": 500, "bucket": timeframe}
+    # Yields pages of assignment dicts for a given course, with "url" set from "html_url"
+    def iter_assignment_pages(self, courseName, timeframe=None):
+        readUrl, params = self.assignment_list_request(courseName, timeframe)
 
-        assignments = requests.request(
-            "GET", readUrl, headers=self.header, params=params
-        ).json()
-        assignmentList = []
+        for page in self._paginate(readUrl, params):
+            for assignment in page:
+                normalizeAssignment(assignment)
+            yield page
 
-        for assignment in assignments:
-            if assignment.get("due_at") == None:
-                assignment["due_at"] = None
+    # (url, params) of the first page of a course's assignment list
+    def assignment_list_request(self, courseName, timeframe=None):
+        readUrl = f"https://{self.schoolAb}/api/v1/courses/{self.courses[courseName]}/assignments/"
+        # include[]=submission joins the current user's own submission into each assignment at no extra request
+        params = {"per_page": PER_PAGE, "bucket": timeframe, "include": ["submission"]}
+        return readUrl, params
 
-            assignment["url"] = assignment["html_url"]
-            assignmentList.append(assignment)
+    # Yields assignment objects for a given course one at a time
+    def iter_assignment_objects(self, courseName, timeframe=None):
+        for page in self.iter_assignment_pages(courseName, timeframe):
+            yield from page
 
-        return assignmentList
+    # Returns a list of all assignment objects for a given course
+    def get_assignment_objects(self, courseName, timeframe=None):
+        return list(self.iter_assignment_objects(courseName, timeframe))
 
-    # Prints version of all currently enrolled classes
+    # Returns assignments for a given course whose url is not already in notionAssignmentsList
     def update_assignment_objects(
         self, notionAssignmentsList, courseName, timeframe=None
     ):
-        readUrl = f"https://{self.schoolAb}/api/v1/courses/{self.courses[courseName]}/assignments/"
-        params = {"per_page": 500, "bucket": timeframe}
-
-        assignments = requests.request(
-            "GET", readUrl, headers=self.header, params=params
-        ).json()
-        assignmentList = []
-
-        for assignment in assignments:
-            if assignment.get("due_at") == None:
-                assignment["due_at"] = None
-            else:
-                assignment["due_at"] = assignment["due_at"]
-
-            assignment["url"] = assignment["html_url"]
-
-            if assignment["url"] not in notionAssignmentsList:
-                assignmentList.append(assignment)
-
-        return assignmentList
+        return [
+            assignment
+            for assignment in self.iter_assignment_objects(courseName, timeframe)
+            if assignment["url"] not in notionAssignmentsList
+        ]
+
+    # Yields pages of planner items across every course, optionally limited to a start_date..end_date window
+    def iter_planner_pages(self, start_date=None, end_date=None):
+        params = {"per_page": PER_PAGE}
+        if start_date is not None:
+            params["start_date"] = _isoDate(start_date)
+        if end_date is not None:
+            params["end_date"] = _isoDate(end_date)
+        readUrl = f"https://{self.schoolAb}/api/v1/planner/items"
+        yield from self._paginate(readUrl, params)
+
+    # Yields an assignment dict, shaped like /courses/:id/assignments ones, for every graded planner item in the window
+    def iter_planner_assignments(self, start_date=None, end_date=None):
+        for page in self.iter_planner_pages(start_date, end_date):
+            for item in page:
+                assignment = plannerItemToAssignment(item, self.schoolAb)
+                if assignment is not None:
+                    yield assignment
 
     def list_classes_names(self):
         for course in self.get_course_objects():
@@ -159,3 +220,86 @@ def cleanCourseName(name):
         cleanName += char
 
     return cleanName
+
+
+# Parses a Canvas timestamp such as "2024-09-01T12:00:00Z" into an aware datetime
+def parseCanvasTimestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+# Fills in the fields the sync relies on for a raw assignment from the REST API
+def normalizeAssignment(assignment):
+    if assignment.get("due_at") == None:
+        assignment["due_at"] = None
+
+    assignment["url"] = assignment["html_url"]
+    return assignment
+
+
+# Whether the current user has handed an assignment in. Uses the per-user "submission" joined into the
+# assignment when present, falling back to the course-wide has_submitted_submissions flag
+def hasSubmitted(assignment):
+    submission = assignment.get("submission")
+    if isinstance(submission, dict):
+        return (
+            submission.get("workflow_state") in SUBMITTED_STATES
+            or bool(submission.get("submitted_at"))
+            or bool(submission.get("excused"))
+        )
+    return bool(assignment.get("has_submitted_submissions"))
+
+
+# Latest time anything the sync writes changed for an assignment. Handing work in or being graded leaves
+# updated_at alone, so the user's own submission times count too
+def assignmentChangedAt(assignment):
+    submission = assignment.get("submission") if isinstance(assignment.get("submission"), dict) else {}
+    times = [
+        parseCanvasTimestamp(value)
+        for value in (assignment.get("updated_at"), submission.get("submitted_at"), submission.get("graded_at"))
+    ]
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+
+# Converts a planner item into the assignment dict the sync expects, or None for items without an assignment
+# (notes, calendar events, ungraded discussions). Quizzes and graded discussions point at their assignment so
+# the URL matches what the per-course assignments endpoint returns
+def plannerItemToAssignment(item, schoolAb):
+    plannable = item.get("plannable") or {}
+    if item.get("plannable_type") == "assignment":
+        assignmentId = item.get("plannable_id")
+    else:
+        assignmentId = plannable.get("assignment_id")
+    courseId = item.get("course_id")
+
+    if assignmentId is None or courseId is None:
+        return None
+
+    url = f"https://{schoolAb}/courses/{courseId}/assignments/{assignmentId}"
+    submissions = item.get("submissions") or {}
+    submitted = bool(submissions.get("submitted"))
+
+    return {
+        "id": assignmentId,
+        "course_id": courseId,
+        "name": plannable.get("title") or plannable.get("name"),
+        "due_at": plannable.get("due_at") or item.get("plannable_date"),
+        "updated_at": plannable.get("updated_at"),
+        "html_url": url,
+        "url": url,
+        # Planner submission state is the current user's own, not the course-wide flag
+        "has_submitted_submissions": submitted,
+        "submission": {
+            "workflow_state": "submitted" if submitted else "unsubmitted",
+            "excused": bool(submissions.get("excused")),
+        },
+    }
+
+
+def _isoDate(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
@@ -0,0 +1,185 @@
+import threading
+from datetime import datetime, timezone
+from .canvas import CanvasApi, parseCanvasTimestamp, PER_PAGE
+
+# Buckets that can be applied to the GraphQL result locally; anything else falls back to the REST endpoint
+LOCAL_BUCKETS = (None, "past", "undated")
+
+ASSIGNMENT_FIELDS = """
+fragment AssignmentFields on Assignment {
+  _id
+  name
+  dueAt
+  htmlUrl
+  updatedAt
+  hasSubmittedSubmissions
+  submissionsConnection(first: 1) {
+    nodes { state submittedAt gradedAt }
+  }
+}
+"""
+
+ALL_COURSES_QUERY = ASSIGNMENT_FIELDS + """
+query AllCourseAssignments($first: Int) {
+  allCourses {
+    _id
+    name
+    state
+    term { _id startAt }
+    assignmentsConnection(first: $first) {
+      nodes { ...AssignmentFields }
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+"""
+
+MORE_ASSIGNMENTS_QUERY = ASSIGNMENT_FIELDS + """
+query MoreCourseAssignments($courseId: ID!, $first: Int, $after: String) {
+  course(id: $courseId) {
+    assignmentsConnection(first: $first, after: $after) {
+      nodes { ...AssignmentFields }
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+"""
+
+
+class CanvasGraphQLError(Exception):
+    pass
+
+
+# CanvasApi backend that loads every course with its assignments through /api/graphql in a handful of
+# requests, then serves the usual REST-shaped course and assignment dicts from memory
+class CanvasGraphQLApi(CanvasApi):
+    def __init__(self, canvasKey, schoolAb="", session=None, cache=None):
+        super().__init__(canvasKey, schoolAb, session=session, cache=cache)
+        self.courseData = None
+        self.assignmentsByCourse = {}
+        self._load_lock = threading.Lock()
+
+    # Posts a GraphQL query and returns its "data", raising on transport or query errors
+    def query(self, query, variables=None):
+        readUrl = f"https://{self.schoolAb}/api/graphql"
+        res = self._request(
+            "POST", readUrl, headers=self.header, json={"query": query, "variables": variables or {}}
+        )
+        res.raise_for_status()
+        payload = res.json()
+
+        if payload.get("errors"):
+            raise CanvasGraphQLError("; ".join(e.get("message", str(e)) for e in payload["errors"]))
+        return payload.get("data") or {}
+
+    # Fetches all courses and their assignments once; later calls reuse the result
+    def load(self):
+        with self._load_lock:
+            if self.courseData is not None:
+                return
+
+            courses = []
+            assignmentsByCourse = {}
+            data = self.query(ALL_COURSES_QUERY, {"first": PER_PAGE})
+
+            for course in data.get("allCourses") or []:
+                if course.get("state") == "deleted":
+                    continue
+
+                connection = course.get("assignmentsConnection") or {}
+                nodes = list(connection.get("nodes") or [])
+                pageInfo = connection.get("pageInfo") or {}
+
+                # Only courses with more than one page of assignments cost extra requests
+                while pageInfo.get("hasNextPage"):
+                    more = self.query(
+                        MORE_ASSIGNMENTS_QUERY,
+                        {"courseId": course["_id"], "first": PER_PAGE, "after": pageInfo.get("endCursor")},
+                    )
+                    connection = (more.get("course") or {}).get("assignmentsConnection") or {}
+                    nodes.extend(connection.get("nodes") or [])
+                    pageInfo = connection.get("pageInfo") or {}
+
+                courseId = int(course["_id"])
+                courses.append(restCourse(course))
+                assignmentsByCourse[courseId] = [restAssignment(node, courseId) for node in nodes if node]
+
+            self.assignmentsByCourse = assignmentsByCourse
+            self.courseData = courses
+
+    # Drops the loaded data so the next call fetches fresh results
+    def reset(self):
+        with self._load_lock:
+            self.courseData = None
+            self.assignmentsByCourse = {}
+
+    def iter_course_pages(self):
+        self.load()
+        yield list(self.courseData)
+
+    def iter_assignment_pages(self, courseName, timeframe=None):
+        if timeframe not in LOCAL_BUCKETS:
+            yield from super().iter_assignment_pages(courseName, timeframe)
+            return
+
+        self.load()
+        now = datetime.now(timezone.utc)
+        assignments = self.assignmentsByCourse.get(self.courses[courseName], [])
+        # Hand out copies so callers can annotate them without touching the cache
+        yield [dict(a) for a in assignments if inBucket(a, timeframe, now)]
+
+
+# REST-style course dict from a GraphQL course node
+def restCourse(node):
+    term = node.get("term") or {}
+    return {
+        "id": int(node["_id"]),
+        "name": node.get("name"),
+        "enrollment_term_id": int(term["_id"]) if term.get("_id") else None,
+        "start_at": term.get("startAt"),
+        "concluded": node.get("state") == "completed",
+    }
+
+
+# REST-style assignment dict from a GraphQL assignment node, as /courses/:id/assignments would return it
+def restAssignment(node, courseId):
+    submissions = (node.get("submissionsConnection") or {}).get("nodes") or []
+    submission = submissions[0] if submissions else None
+    return {
+        "id": int(node["_id"]),
+        "course_id": courseId,
+        "name": node.get("name"),
+        "due_at": restTimestamp(node.get("dueAt")),
+        "updated_at": restTimestamp(node.get("updatedAt")),
+        "html_url": node.get("htmlUrl"),
+        "url": node.get("htmlUrl"),
+        "has_submitted_submissions": bool(node.get("hasSubmittedSubmissions")),
+        "submission": (
+            {
+                "workflow_state": submission.get("state"),
+                "submitted_at": restTimestamp(submission.get("submittedAt")),
+                "graded_at": restTimestamp(submission.get("gradedAt")),
+            }
+            if submission
+            else None
+        ),
+    }
+
+
+# GraphQL returns local offsets; REST uses UTC with a Z suffix, which the rest of the sync expects
+def restTimestamp(value):
+    parsed = parseCanvasTimestamp(value)
+    if parsed is None:
+        return None
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def inBucket(assignment, bucket, now):
+    if bucket is None:
+        return True
+    due = parseCanvasTimestamp(assignment.get("due_at"))
+    if bucket == "undated":
+        return due is None
+    if bucket == "past":
+        return due is not None and due < now
+    return True
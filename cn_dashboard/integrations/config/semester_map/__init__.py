@@ -1 +1,7 @@
-from .semesters import SEMESTER_RANGES
\ No newline at end of file
+from .semesters import semester_ranges
+
+def __getattr__(name):
+    if name == "SEMESTER_RANGES":
+        from . import semesters
+        return semesters.SEMESTER_RANGES
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
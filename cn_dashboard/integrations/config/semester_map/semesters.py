@@ -1,5 +1,16 @@
-from datetime import date
+from functools import lru_cache
 from ...config.student import MATRIC_YEAR
 from ...scripts.date_helpers import buildSemesterRanges
 
-SEMESTER_RANGES = buildSemesterRanges(MATRIC_YEAR)
\ No newline at end of file
+"""
+Semester ranges for a matriculation year, built on first use and shared by every caller with that year.
+"""
+@lru_cache(maxsize=32)
+def semester_ranges(matric_year: int = MATRIC_YEAR):
+    return tuple(buildSemesterRanges(matric_year))
+
+# Built lazily so importing the package doesn't compute ranges up front
+def __getattr__(name):
+    if name == "SEMESTER_RANGES":
+        return list(semester_ranges(MATRIC_YEAR))
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1 +1,7 @@
-from .weeks import WEEK_RANGES_BY_SEMESTER
\ No newline at end of file
+from .weeks import week_ranges_by_semester
+
+def __getattr__(name):
+    if name == "WEEK_RANGES_BY_SEMESTER":
+        from . import weeks
+        return weeks.WEEK_RANGES_BY_SEMESTER
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,16 @@
+from functools import lru_cache
 from ...config.student import MATRIC_YEAR
 from ...scripts.date_helpers import buildWeekRangesForUniTerm
 
-WEEK_RANGES_BY_SEMESTER = buildWeekRangesForUniTerm(matric_year=MATRIC_YEAR)
\ No newline at end of file
+"""
+Week ranges per semester for a matriculation year, built on first use and shared by every caller with that year.
+"""
+@lru_cache(maxsize=32)
+def week_ranges_by_semester(matric_year: int = MATRIC_YEAR):
+    return buildWeekRangesForUniTerm(matric_year=matric_year)
+
+# Built lazily so importing the package doesn't compute ranges up front
+def __getattr__(name):
+    if name == "WEEK_RANGES_BY_SEMESTER":
+        return week_ranges_by_semester(MATRIC_YEAR)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
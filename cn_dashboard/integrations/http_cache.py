@@ -0,0 +1,76 @@
+import hashlib, json, os, tempfile, time
+
+# Cached responses older than this are dropped and fetched in full again
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+
+# Minimal on-disk store with the get/set interface of Django's cache, one JSON file per key
+class DiskStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(":", "_") + ".json")
+
+    def get(self, key, default=None):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return default
+        if entry.get("expires") is not None and entry["expires"] < time.time():
+            return default
+        return entry.get("value", default)
+
+    def set(self, key, value, timeout=DEFAULT_TTL):
+        expires = time.time() + timeout if timeout is not None else None
+        # Write to a temp file first so concurrent readers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires": expires, "value": value}, f)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+# Conditional GET cache for one API token: remembers each response's ETag / Last-Modified alongside its parsed
+# payload, so a 304 can be answered from the stored copy. Keys are hashed with the token, so users never share entries
+class ResponseCache:
+    def __init__(self, store, token, ttl=DEFAULT_TTL):
+        self.store = store
+        self.ttl = ttl
+        self.scope = hashlib.sha256(token.encode()).hexdigest()[:16]
+
+    def key(self, url, params=None):
+        params = sorted((k, json.dumps(v, sort_keys=True)) for k, v in (params or {}).items() if v is not None)
+        raw = json.dumps([self.scope, url, params])
+        return "canvas-http:" + hashlib.sha256(raw.encode()).hexdigest()
+
+    def lookup(self, url, params=None):
+        return self.store.get(self.key(url, params))
+
+    # Validator headers to send for a stored entry
+    def conditionalHeaders(self, entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    # Stores a 200 response's payload if it came with a validator; returns the entry either way
+    def remember(self, url, params, res, payload):
+        entry = {
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "payload": payload,
+            "next": res.links.get("next", {}).get("url"),
+        }
+        if entry["etag"] or entry["last_modified"]:
+            self.store.set(self.key(url, params), entry, self.ttl)
+        return entry
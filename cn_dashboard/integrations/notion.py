@@ -1,6 +1,19 @@
-import requests, json
+import requests, json, time
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from .ratelimit import bucket_for, retry_delay, RETRY_STATUSES, MAX_RETRIES
+from .session import build_session
 from .config.schema import NOTION_DB_PROPERTIES
-from .scripts.select_helpers import compute_week_from_due, compute_semester_from_due
+from .scripts.select_helpers import calendar_for
+
+# Largest page size the Notion query endpoint accepts
+QUERY_PAGE_SIZE = 100
+# Pages created or updated at once; the shared token bucket keeps them under Notion's rate limit
+DEFAULT_WRITE_WORKERS = 3
+# A stored index older than this is rebuilt from a full scan, since archived or deleted pages never show up in the
+# last_edited_time query and would otherwise stay in it forever
+FULL_RECONCILE_INTERVAL = timedelta(days=7)
 
 class NotionApi:
     def __init__(
@@ -13,14 +26,25 @@ class NotionApi:
         semester_label=None,
         semester_phases=None,
         version="2021-08-16",
+        session=None,
+        write_workers=DEFAULT_WRITE_WORKERS,
+        calendar=None,
     ):
         self.database_id = database_id
+        self.session = session or build_session()
+        # Notion rate-limits per integration token, so every NotionApi for that token shares one bucket
+        self.rateLimiter = bucket_for(notionToken)
+        self.write_workers = max(1, write_workers or 1)
         self.notionToken = notionToken
         self.schoolAb = schoolAb
         self.semester_start_date = semester_start_date
         self.semester_end_date = semester_end_date
         self.semester_label = semester_label
         self.semester_phases = semester_phases or []
+        # Compiled AcademicCalendar used to label Week/Semester; built from the raw settings if not given
+        self.calendar = calendar or calendar_for(
+            (semester_start_date, semester_end_date), semester_label, self.semester_phases
+        )
         self.notionHeaders = {
             "Authorization": "Bearer " + notionToken,
             "Content-Type": "application/json",
@@ -28,12 +52,65 @@ class NotionApi:
         }
         self._db_properties = None
         self._assignment_cache = None
+        # Guards the assignment index, which concurrent write workers update as responses come back
+        self._index_lock = threading.RLock()
+        self.indexReconciledAt = None
+
+    # Sends a request through the rate limiter, retrying 429/502/503 with Retry-After or jittered backoff
+    def _request(self, method, url, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self.rateLimiter.acquire()
+            res = self.session.request(method, url, **kwargs)
+
+            if res.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return res
+
+            delay = retry_delay(res, attempt)
+            if res.status_code == 429:
+                # Hold back every worker sharing this token, not just this one
+                self.rateLimiter.pause(delay)
+            else:
+                time.sleep(delay)
+        return res
 
-    def queryDatabase(self):
+    # Applies fn to every item through a small worker pool, returning results in item order
+    def mapWrites(self, fn, items):
+        items = list(items)
+        if self.write_workers == 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.write_workers, len(items))) as executor:
+            return list(executor.map(fn, items))
+
+    # Yields the results of a database query one page at a time, following next_cursor until has_more is false.
+    # An error response part-way through raises instead of ending early, so nothing is planned from a partial index
+    def iterDatabasePages(self, filter=None, sorts=None):
         readUrl = f"https://api.notion.com/v1/databases/{self.database_id}/query"
+        body = {"page_size": QUERY_PAGE_SIZE}
+        if filter:
+            body["filter"] = filter
+        if sorts:
+            body["sorts"] = sorts
+
+        while True:
+            res = self._request("POST", readUrl, headers=self.notionHeaders, data=json.dumps(body))
+            res.raise_for_status()
+            data = res.json()
 
-        res = requests.request("POST", readUrl, headers=self.notionHeaders)
-        data = res.json()
+            if not isinstance(data, dict) or data.get("object") == "error":
+                raise requests.HTTPError(f"Notion database query failed: {res.text}", response=res)
+
+            yield data.get("results") or []
+
+            if not data.get("has_more") or not data.get("next_cursor"):
+                return
+            body["start_cursor"] = data.get("next_cursor")
+
+    def queryDatabase(self):
+        results = []
+        for page in self.iterDatabasePages():
+            results.extend(page)
+        data = {"object": "list", "results": results, "has_more": False, "next_cursor": None}
 
         with open("./db.json", "w", encoding="utf8") as f:
             json.dump(data, f, ensure_ascii=False)
@@ -41,7 +118,7 @@ class NotionApi:
         return data
 
     def test_if_database_id_exists(self):
-        res = requests.request(
+        res = self._request(
             "GET",
             f"https://api.notion.com/v1/databases/{self.database_id}/",
             headers=self.notionHeaders,
@@ -55,7 +132,7 @@ class NotionApi:
         if self._db_properties is not None:
             return self._db_properties
 
-        res = requests.request(
+        res = self._request(
             "GET",
             f"https://api.notion.com/v1/databases/{self.database_id}/",
             headers=self.notionHeaders,
@@ -139,7 +216,7 @@ class NotionApi:
 
         data = json.dumps(newPageData)
 
-        res = requests.request(
+        res = self._request(
             "POST",
             "https://api.notion.com/v1/databases",
             headers=self.notionHeaders,
@@ -152,23 +229,17 @@ class NotionApi:
 
         return newDbId
 
-    def createNewDatabaseItem(
+    # Builds the page properties for an assignment, keeping only those the database supports
+    def _build_item_properties(
         self,
-        id,
         className,
         assignmentName,
         has_submitted=False,
         url=None,
         dueDate=None,
     ):
-        # if status:
-        #     status = "To do"
-        # else:
-        #     status = "Completed"
-
-        createUrl = "https://api.notion.com/v1/pages"
-
         status_name = "Done" if has_submitted else "Not started"
+        semester, week = self.calendar.classify(dueDate)
 
         properties = {
             "Status": self._build_status_property(status_name),
@@ -197,34 +268,57 @@ class NotionApi:
             },
                 "Week": {
                     "select": {
-                        "name": compute_week_from_due(
-                            dueDate,
-                            custom_range=(self.semester_start_date, self.semester_end_date),
-                            custom_label=self.semester_label,
-                            custom_phases=self.semester_phases,
-                        ),
+                        "name": week,
                     }
                 },
                 "Semester": {
                     "select": {
-                        "name": compute_semester_from_due(
-                            dueDate,
-                            custom_range=(self.semester_start_date, self.semester_end_date),
-                            custom_label=self.semester_label,
-                            custom_phases=self.semester_phases,
-                        ),
+                        "name": semester,
                     }
                 },
         }
 
-        newPageData = {
+        return self._filter_properties_for_database(properties)
+
+    # Request body that creates an assignment page in this database
+    def newPageData(self, className, assignmentName, has_submitted=False, url=None, dueDate=None):
+        return {
             "parent": {"database_id": self.database_id},
-            "properties": self._filter_properties_for_database(properties),
+            "properties": self._build_item_properties(
+                className, assignmentName, has_submitted, url, dueDate
+            ),
         }
 
+    # Request body that rewrites an existing assignment page
+    def updatePageData(self, className, assignmentName, has_submitted=False, url=None, dueDate=None):
+        return {
+            "properties": self._build_item_properties(
+                className, assignmentName, has_submitted, url, dueDate
+            ),
+        }
+
+    def createNewDatabaseItem(
+        self,
+        id,
+        className,
+        assignmentName,
+        has_submitted=False,
+        url=None,
+        dueDate=None,
+    ):
+        # if status:
+        #     status = "To do"
+        # else:
+        #     status = "Completed"
+
+        createUrl = "https://api.notion.com/v1/pages"
+
+        newPageData = self.newPageData(className, assignmentName, has_submitted, url, dueDate)
+
         data = json.dumps(newPageData)
 
-        res = requests.request("POST", createUrl, headers=self.notionHeaders, data=data)
+        res = self._request("POST", createUrl, headers=self.notionHeaders, data=data)
+        self._record_write(res)
 
         print(res.text)
 
@@ -241,67 +335,36 @@ class NotionApi:
     ):
         updateUrl = f"https://api.notion.com/v1/pages/{page_id}"
 
-        status_name = "Done" if has_submitted else "Not started"
-
-        properties = {
-            "Status": self._build_status_property(status_name),
-            "Assignment": {
-                "type": "title",
-                "title": [
-                    {
-                        "text": {
-                            "content": assignmentName,
-                        },
-                    }
-                ],
-            },
-            "Class": {
-                "select": {
-                    "name": className,
-                }
-            },
-            "Due Date": {
-                "date": {
-                    "start": dueDate,
-                } if dueDate else None,
-            },
-            "URL": {
-                "url": url,
-            },
-                "Week": {
-                    "select": {
-                        "name": compute_week_from_due(
-                            dueDate,
-                            custom_range=(self.semester_start_date, self.semester_end_date),
-                            custom_label=self.semester_label,
-                            custom_phases=self.semester_phases,
-                        ),
-                    }
-                },
-                "Semester": {
-                    "select": {
-                        "name": compute_semester_from_due(
-                            dueDate,
-                            custom_range=(self.semester_start_date, self.semester_end_date),
-                            custom_label=self.semester_label,
-                            custom_phases=self.semester_phases,
-                        ),
-                    }
-                },
-        }
-
-        updatePageData = {
-            "properties": self._filter_properties_for_database(properties),
-        }
+        updatePageData = self.updatePageData(className, assignmentName, has_submitted, url, dueDate)
 
         data = json.dumps(updatePageData)
 
-        res = requests.request("PATCH", updateUrl, headers=self.notionHeaders, data=data)
+        res = self._request("PATCH", updateUrl, headers=self.notionHeaders, data=data)
+        self._record_write(res, page_id)
 
         print(res.text)
 
         return res
 
+    # True when the page's current values already match what an update would write
+    def isPageUnchanged(
+        self,
+        page_id,
+        className,
+        assignmentName,
+        has_submitted=False,
+        url=None,
+        dueDate=None,
+    ):
+        current = self._parse_database_for_assignments().get("fingerprints", {}).get(page_id)
+        if current is None:
+            return False
+
+        properties = self._build_item_properties(
+            className, assignmentName, has_submitted, url, dueDate
+        )
+        return fingerprintProperties(properties) == current
+
     def parseDatabaseForAssignments(self):
         # Return a mapping of assignment URL -> notion page id for quick lookups
         return self._parse_database_for_assignments().get("by_url", {})
@@ -314,43 +377,165 @@ class NotionApi:
         if self._assignment_cache is not None:
             return self._assignment_cache
 
-        mapping_by_url = {}
-        mapping_by_key = {}
-        data = self.queryDatabase()
+        self.indexReconciledAt = _reconcile_watermark()
+        index = _empty_index()
 
-        results = data.get("results") if data is not None else []
-        if results:
+        # Index each page of results as it arrives so the raw response is never held whole
+        for results in self.iterDatabasePages():
             for item in results:
-                page_id = item.get("id")
-                props = item.get("properties", {})
-
-                url = None
-                try:
-                    url = props.get("URL", {}).get("url")
-                except Exception:
-                    url = None
-
-                assignment_title = None
-                try:
-                    title_parts = props.get("Assignment", {}).get("title", [])
-                    assignment_title = "".join([t.get("plain_text", "") for t in title_parts]).strip() or None
-                except Exception:
-                    assignment_title = None
-
-                class_name = None
-                try:
-                    class_name = props.get("Class", {}).get("select", {}).get("name")
-                except Exception:
-                    class_name = None
-
-                if url:
-                    mapping_by_url[url] = page_id
-                if class_name and assignment_title:
-                    key = f"{class_name}||{assignment_title}"
-                    mapping_by_key[key] = page_id
-
-        self._assignment_cache = {
-            "by_url": mapping_by_url,
-            "by_key": mapping_by_key,
+                self._index_database_item(item, index)
+
+        self._assignment_cache = index
+        return self._assignment_cache
+
+    # Seeds the index from stored page entries, then only queries pages edited on or after `since`.
+    # Falls back to a full scan when there is no stored reconcile time or it is older than FULL_RECONCILE_INTERVAL
+    def loadAssignmentIndex(self, pages, since=None):
+        if since is None or since < datetime.now(timezone.utc) - FULL_RECONCILE_INTERVAL:
+            self._assignment_cache = None
+            return self._parse_database_for_assignments()
+
+        self.indexReconciledAt = _reconcile_watermark()
+        index = _empty_index()
+        for page_id, entry in pages.items():
+            self._index_entry(page_id, entry, index)
+
+        edited_filter = {
+            "timestamp": "last_edited_time",
+            "last_edited_time": {"on_or_after": since.isoformat()},
         }
+        for results in self.iterDatabasePages(filter=edited_filter):
+            for item in results:
+                self._index_database_item(item, index)
+
+        self._assignment_cache = index
         return self._assignment_cache
+
+    # page_id -> {"url", "key", "fingerprint", "last_edited_time"} for every indexed page
+    def assignmentIndexPages(self):
+        return self._parse_database_for_assignments().get("pages", {})
+
+    def _index_database_item(self, item, index=None):
+        page_id = item.get("id")
+        props = item.get("properties", {})
+
+        url = None
+        try:
+            url = props.get("URL", {}).get("url")
+        except Exception:
+            url = None
+
+        assignment_title = None
+        try:
+            title_parts = props.get("Assignment", {}).get("title", [])
+            assignment_title = "".join([t.get("plain_text", "") for t in title_parts]).strip() or None
+        except Exception:
+            assignment_title = None
+
+        class_name = None
+        try:
+            class_name = props.get("Class", {}).get("select", {}).get("name")
+        except Exception:
+            class_name = None
+
+        key = f"{class_name}||{assignment_title}" if class_name and assignment_title else None
+        entry = {
+            "url": url,
+            "key": key,
+            "fingerprint": fingerprintProperties(props),
+            "last_edited_time": item.get("last_edited_time"),
+        }
+        self._index_entry(page_id, entry, index)
+
+    def _index_entry(self, page_id, entry, index=None):
+        index = index if index is not None else self._assignment_cache
+        if index is None or not page_id:
+            return
+
+        with self._index_lock:
+            self._drop_entry(page_id, index)
+            index["pages"][page_id] = entry
+            if entry.get("url"):
+                index["by_url"][entry["url"]] = page_id
+            if entry.get("key"):
+                index["by_key"][entry["key"]] = page_id
+            index["fingerprints"][page_id] = entry.get("fingerprint")
+
+    # Removes a page that Notion no longer lets us edit, so the next sync recreates it
+    def forgetPage(self, page_id):
+        if self._assignment_cache is None:
+            return
+        with self._index_lock:
+            self._drop_entry(page_id, self._assignment_cache)
+
+    def _drop_entry(self, page_id, index):
+        old = index["pages"].pop(page_id, None)
+        index["fingerprints"].pop(page_id, None)
+        if old is None:
+            return
+        if old.get("url") and index["by_url"].get(old["url"]) == page_id:
+            del index["by_url"][old["url"]]
+        if old.get("key") and index["by_key"].get(old["key"]) == page_id:
+            del index["by_key"][old["key"]]
+
+    # Folds a create/update response back into the index, or drops pages that are gone
+    def _record_write(self, res, page_id=None):
+        status = getattr(res, "status_code", None)
+        if status and 200 <= status < 300:
+            try:
+                self._index_database_item(res.json())
+            except ValueError:
+                pass
+        elif page_id and (status == 404 or "archived" in getattr(res, "text", "")):
+            self.forgetPage(page_id)
+
+
+def _empty_index():
+    return {"by_url": {}, "by_key": {}, "fingerprints": {}, "pages": {}}
+
+
+# Notion rounds last_edited_time to the minute, so reconcile from a minute before the query started
+def _reconcile_watermark():
+    return datetime.now(timezone.utc) - timedelta(minutes=1)
+
+
+# Properties compared to decide whether a page needs a PATCH
+FINGERPRINT_PROPERTIES = ("Status", "Due Date", "Class", "Week", "Semester", "Assignment", "URL")
+
+
+# Reduces a property value, either as Notion returns it or as we send it, to a comparable form
+def _comparable_value(prop):
+    if not isinstance(prop, dict):
+        return None
+    if "select" in prop or "status" in prop:
+        option = prop.get("select") or prop.get("status") or {}
+        return option.get("name")
+    if "date" in prop:
+        start = (prop.get("date") or {}).get("start")
+        if not start:
+            return None
+        try:
+            parsed = datetime.fromisoformat(start.replace("Z", "+00:00"))
+        except ValueError:
+            return start
+        # Notion echoes dates back with milliseconds and its own offset, so compare in UTC
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+        return parsed.isoformat()
+    if "url" in prop:
+        return prop.get("url")
+    if "title" in prop:
+        return "".join(
+            t.get("plain_text") or t.get("text", {}).get("content", "")
+            for t in prop.get("title") or []
+        ).strip()
+    return None
+
+
+# JSON-safe fingerprint of the compared properties present in a page's properties
+def fingerprintProperties(properties):
+    return {
+        name: _comparable_value(properties.get(name))
+        for name in FINGERPRINT_PROPERTIES
+        if name in properties
+    }
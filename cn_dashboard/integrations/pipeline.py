@@ -0,0 +1,75 @@
+import queue, threading
+from concurrent.futures import ThreadPoolExecutor
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+# Iterates source on a background thread and yields its items through a queue holding at most maxsize,
+# so the producer keeps working while the caller consumes but never runs more than maxsize items ahead.
+# Errors raised by the source are re-raised in the caller
+def stream(source, maxsize):
+    items = queue.Queue(maxsize=max(1, maxsize))
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in source:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(_Failure(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Lets a producer blocked on a full queue give up when the caller stops early
+        cancelled.set()
+        thread.join()
+
+
+# Thread pool whose submit() blocks once maxsize tasks are waiting on top of those running,
+# so a fast producer can't queue up unbounded work ahead of the workers
+class BoundedExecutor:
+    def __init__(self, workers, maxsize):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.slots = threading.BoundedSemaphore(max(1, workers) + max(0, maxsize))
+
+    def submit(self, fn, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(wait=True)
+        return False
@@ -0,0 +1,190 @@
+import random, threading, time
+
+# Notion allows an average of about 3 requests per second per integration
+NOTION_RATE = 3.0
+NOTION_BURST = 3
+# Statuses worth retrying, and how often
+RETRY_STATUSES = (429, 502, 503)
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Canvas meters each token with a leaky bucket of about 700 units and throttles with a 403 when it runs dry
+CANVAS_BUCKET_SIZE = 700.0
+# Below this many units left, shed parallelism; above the high mark, add it back
+CANVAS_LOW_REMAINING = 150.0
+CANVAS_HIGH_REMAINING = 450.0
+CANVAS_MIN_CONCURRENCY = 1
+CANVAS_MAX_CONCURRENCY = 8
+# Canvas drains its bucket at roughly this many units per second
+CANVAS_DRAIN_RATE = 10.0
+# How often async callers re-check for a free slot while every one is busy
+CANVAS_SLOT_POLL_INTERVAL = 0.05
+
+
+# Thread-safe token bucket; acquire() blocks until a request may be sent
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    # Takes a token if one is free and returns 0, otherwise returns how long to wait before trying again.
+    # Lets async callers sleep without holding a thread
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    # Stop handing out tokens for the given number of seconds, e.g. after a Retry-After header
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+# Returns the shared bucket for key, so every client using the same token shares one budget
+def bucket_for(key, rate=NOTION_RATE, capacity=NOTION_BURST):
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate, capacity)
+        return _buckets[key]
+
+
+# Seconds to wait before retry number `attempt`, preferring the server's Retry-After
+def retry_delay(res, attempt):
+    retry_after = res.headers.get("Retry-After") if res is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    delay = min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# Concurrency limiter for one Canvas host, steered by the X-Rate-Limit-Remaining and X-Request-Cost headers.
+# Parallelism grows by one while the bucket stays healthy and halves as it nears empty, so requests slow
+# down before Canvas starts answering 403
+class AdaptiveLimiter:
+    def __init__(self, start=2, minimum=CANVAS_MIN_CONCURRENCY, maximum=CANVAS_MAX_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(start, maximum))
+        self.in_flight = 0
+        self.remaining = CANVAS_BUCKET_SIZE
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self._take_locked()
+                if wait == 0:
+                    return
+                self.cond.wait(wait)
+
+    # Non-blocking acquire(): 0 once a slot is taken, otherwise the pause left or, while every slot is busy,
+    # CANVAS_SLOT_POLL_INTERVAL, since a freed slot can't wake a caller that isn't waiting on cond
+    def try_acquire(self):
+        with self.cond:
+            wait = self._take_locked()
+        return CANVAS_SLOT_POLL_INTERVAL if wait is None else wait
+
+    # 0 once a slot is taken, the time left on a pause, or None while every slot is busy
+    def _take_locked(self):
+        wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.in_flight < self.limit:
+            self.in_flight += 1
+            return 0
+        return None
+
+    # Hands back the slot taken by acquire() and adjusts the limit from the response headers
+    def release(self, res=None):
+        with self.cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if res is not None:
+                self._observe(res)
+            self.cond.notify_all()
+
+    def _observe(self, res):
+        remaining = _header_float(res, "X-Rate-Limit-Remaining")
+        cost = _header_float(res, "X-Request-Cost") or 0.0
+
+        if is_canvas_throttled(res):
+            self.limit = self.minimum
+            self.remaining = 0.0
+            self._pause_locked(CANVAS_BUCKET_SIZE * 0.1 / CANVAS_DRAIN_RATE)
+            return
+        if remaining is None:
+            return
+
+        self.remaining = remaining
+        if remaining < CANVAS_LOW_REMAINING:
+            self.limit = max(self.minimum, self.limit // 2)
+            # Give the bucket time to drain back above the low mark, allowing for what this request cost
+            self._pause_locked((CANVAS_LOW_REMAINING - remaining + cost) / CANVAS_DRAIN_RATE)
+        elif remaining > CANVAS_HIGH_REMAINING and self.in_flight + 1 >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+
+    def _pause_locked(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def pause(self, seconds):
+        with self.cond:
+            self._pause_locked(seconds)
+            self.cond.notify_all()
+
+
+def _header_float(res, name):
+    try:
+        return float(res.headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+# Canvas reports throttling as 403 with "Rate Limit Exceeded" in the body instead of a 429
+def is_canvas_throttled(res):
+    if res is None or res.status_code != 403:
+        return False
+    if _header_float(res, "X-Rate-Limit-Remaining") == 0:
+        return True
+    try:
+        return "rate limit exceeded" in res.text.lower()
+    except Exception:
+        return False
+
+
+_limiters = {}
+
+
+# Returns the shared limiter for a Canvas host, so every user syncing against the same school shares it
+def limiter_for(host):
+    key = (host or "").strip().lower()
+    with _buckets_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter()
+        return _limiters[key]
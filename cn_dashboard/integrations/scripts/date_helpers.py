@@ -1,3 +1,4 @@
+from array import array
 from datetime import date, datetime, timedelta, timezone
 from ..config.student import UTC_OFFSET
 
@@ -11,9 +12,10 @@ Helpers relating to generating date mappings.
 """
 Convert Canvas UTC due_at string to Singapore ISO format string.
 """
-def date_to_sg_offset_iso(due_at: str) -> str:
+def date_to_sg_offset_iso(due_at: str, utc_offset: float | None = None) -> str:
     dt_utc = datetime.fromisoformat(due_at.replace("Z", "+00:00"))
-    return dt_utc.astimezone(TIMEZONE).isoformat()
+    tz = TIMEZONE if utc_offset is None else timezone(timedelta(hours=utc_offset))
+    return dt_utc.astimezone(tz).isoformat()
 
 def firstWeekdayOfMonth(year: int, month: int, weekday: int) -> date:
     d = date(year, month, 1)
@@ -171,4 +173,24 @@ def buildWeekRangesForUniTerm(matric_year: int):
         "Y4S1": computeWeekRangesForSemester1(matric_year, 4),
         "Y4S2": computeWeekRangesForSemester2(matric_year, 4),
     }
-    return week_ranges
\ No newline at end of file
+    return week_ranges
+
+"""
+Dense lookup table over every day from start to end inclusive.
+Returns (base_ordinal, ids, labels) where labels[ids[d.toordinal() - base_ordinal]] == labelForDate(d).
+"""
+def buildDayLabelTable(labelForDate, start: date, end: date):
+    labels = []
+    label_ids = {}
+    ids = array("H")
+
+    d = start
+    while d <= end:
+        label = labelForDate(d)
+        if label not in label_ids:
+            label_ids[label] = len(labels)
+            labels.append(label)
+        ids.append(label_ids[label])
+        d += timedelta(days=1)
+
+    return start.toordinal(), ids, labels
@@ -1,40 +1,93 @@
+from bisect import bisect_right
 from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Union
-from ..config.semester_map import SEMESTER_RANGES
-from ..config.student import UTC_OFFSET
-from ..config.week_map import WEEK_RANGES_BY_SEMESTER
+from ..config.semester_map import semester_ranges
+from ..config.student import MATRIC_YEAR, UTC_OFFSET
+from ..config.week_map import week_ranges_by_semester
+from .date_helpers import buildDayLabelTable
 
 TIMEZONE = timezone(timedelta(hours=UTC_OFFSET))
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Longest span of days the dense (semester, week) table covers; wider calendars use bisect only
+MAX_TABLE_DAYS = 366 * 12
 
-def compute_semester_from_due(
-    due: Union[date, datetime, str],
-    custom_range: tuple | None = None,
-    custom_label: str | None = None,
-    custom_phases: list | None = None,
-) -> str:
-    if due is None or due == "":
-        return "N/A"
+"""
+(name, start, end) ranges flattened into sorted disjoint segments answered with a bisect.
+Where ranges overlap the one listed first wins, matching a front-to-back linear scan.
+"""
+class IntervalIndex:
+    def __init__(self, ranges):
+        ranges = [(name, start, end) for name, start, end in ranges if start <= end]
+        points = sorted({start for _, start, _ in ranges} | {end + timedelta(days=1) for _, _, end in ranges})
+
+        self.starts = points
+        self.names = []
+        for point in points:
+            self.names.append(next(
+                (name for name, start, end in ranges if start <= point <= end),
+                None,
+            ))
 
-    # parse
+    def lookup(self, d: date):
+        i = bisect_right(self.starts, d) - 1
+        return self.names[i] if i >= 0 else None
+
+
+"""
+Indexes over the default semester and week ranges of a matriculation year, built on first use.
+"""
+@lru_cache(maxsize=32)
+def default_semester_index(matric_year: int = MATRIC_YEAR) -> IntervalIndex:
+    return IntervalIndex(semester_ranges(matric_year))
+
+@lru_cache(maxsize=32)
+def default_week_indexes(matric_year: int = MATRIC_YEAR) -> dict:
+    return {
+        semester: IntervalIndex(ranges)
+        for semester, ranges in week_ranges_by_semester(matric_year).items()
+    }
+
+
+"""
+Parse a due value (date, datetime or Canvas/ISO string) into a local date.
+"""
+def parse_due_date(due: Union[date, datetime, str], tz: timezone = TIMEZONE) -> date:
     if isinstance(due, str):
         s = due.strip()
 
         if "T" not in s:
-            d = date.fromisoformat(s)
-        else:
-            dt = datetime.fromisoformat(
-                s.replace("Z", "+00:00")
-            )
-            d = dt.astimezone(TIMEZONE).date()
+            return date.fromisoformat(s)
+        dt = datetime.fromisoformat(
+            s.replace("Z", "+00:00")
+        )
+        return dt.astimezone(tz).date()
     elif isinstance(due, datetime):
         if due.tzinfo is None:
             due = due.replace(tzinfo=timezone.utc)
-        d = due.astimezone(TIMEZONE).date()
-    else:
-        d = due
+        return due.astimezone(tz).date()
+    return due
+
 
-    if custom_phases:
-        for phase in custom_phases:
+"""
+A user's semester phases, custom range and the default ranges compiled into one index.
+Phases win over the custom range, which wins over the defaults, same as checking them in turn.
+"""
+class AcademicCalendar:
+    def __init__(
+        self,
+        custom_range: tuple | None = None,
+        custom_label: str | None = None,
+        custom_phases: list | None = None,
+        matric_year: int = MATRIC_YEAR,
+        utc_offset: float = UTC_OFFSET,
+    ):
+        self.matric_year = matric_year
+        self.utc_offset = utc_offset
+        self.timezone = timezone(timedelta(hours=utc_offset))
+        ranges = []
+
+        for phase in custom_phases or []:
             name = phase.get("name") if isinstance(phase, dict) else None
             start = phase.get("start") if isinstance(phase, dict) else None
             end = phase.get("end") if isinstance(phase, dict) else None
@@ -46,18 +99,169 @@ def compute_semester_from_due(
             except Exception:
                 start = None
                 end = None
-            if name and start and end and start <= d <= end:
-                return name
+            if name and start and end:
+                ranges.append((name, start, end))
+
+        if custom_range and len(custom_range) == 2:
+            custom_start, custom_end = custom_range
+            if custom_start and custom_end:
+                ranges.append((custom_label or "Custom Semester", custom_start, custom_end))
+
+        ranges.extend(semester_ranges(matric_year))
+        self.semester_index = IntervalIndex(ranges)
+        self.week_indexes = default_week_indexes(matric_year)
+
+        # Every labelled day mapped straight to its (semester, week) id, so classifying is one index
+        self.table_base = None
+        self.table_ids = None
+        self.table_labels = None
+        if ranges:
+            first = min(start for _, start, _ in ranges)
+            last = max(end for _, _, end in ranges)
+            if 0 <= (last - first).days < MAX_TABLE_DAYS:
+                self.table_base, self.table_ids, self.table_labels = buildDayLabelTable(
+                    self._labels_for_date, first, last
+                )
+
+    def _labels_for_date(self, d: date) -> tuple:
+        semester = self.semester_for_date(d)
+        return semester, self.week_for_date(d, semester)
+
+    # (semester, week) for a local date, from the dense table when it covers d
+    def labels_for_date(self, d: date) -> tuple:
+        if self.table_ids is not None:
+            i = d.toordinal() - self.table_base
+            if 0 <= i < len(self.table_ids):
+                return self.table_labels[self.table_ids[i]]
+        return self._labels_for_date(d)
+
+    def semester_for_date(self, d: date) -> str:
+        return self.semester_index.lookup(d)
+
+    def week_for_date(self, d: date, semester: str) -> str:
+        if semester is None or semester == "N/A":
+            return "N/A"
+        elif "Special Term" in semester:
+            return "Special Term"
+        elif "Winter Term" in semester:
+            return "Winter Term"
+
+        index = self.week_indexes.get(semester)
+        return index.lookup(d) if index else None
+
+    # (semester, week) for a due value, parsed once
+    def classify(self, due: Union[date, datetime, str]) -> tuple:
+        if due is None or due == "":
+            return "N/A", "N/A"
+
+        return self.labels_for_date(parse_due_date(due, self.timezone))
+
+    # Classify a whole list of due values at once, returning (semesters, weeks) lists in input order
+    def classify_many(self, dues: list) -> tuple:
+        dues = list(dues)
+        np = _numpy() if self.table_ids is not None and dues else None
+        if np is None:
+            labels = [self.classify(due) for due in dues]
+            return [label[0] for label in labels], [label[1] for label in labels]
+
+        # Canvas due_at strings ("...Z") are converted in bulk; anything else goes through classify()
+        raw = np.array(dues, dtype=object)
+        is_canvas = np.array(
+            [isinstance(due, str) and len(due) > 11 and due[10] == "T" and due[-1] == "Z" for due in dues],
+            dtype=bool,
+        )
+        semesters = np.empty(len(dues), dtype=object)
+        weeks = np.empty(len(dues), dtype=object)
+
+        if is_canvas.any():
+            utc = np.array([due[:-1] for due in raw[is_canvas]], dtype="datetime64[s]")
+            local_days = (utc + np.timedelta64(int(self.utc_offset * 3600), "s")).astype("datetime64[D]")
+            offsets = local_days.astype(np.int64) + (EPOCH_ORDINAL - self.table_base)
+
+            # The table spans every range, so days outside it share the "no semester" label kept in the last slot
+            table = np.frombuffer(self.table_ids, dtype=np.uint16)
+            outside = len(self.table_labels)
+            ids = np.full(len(offsets), outside, dtype=np.int64)
+            inside = (offsets >= 0) & (offsets < len(table))
+            ids[inside] = table[offsets[inside]]
+
+            labels = self.table_labels + [self._labels_for_date(date.min)]
+            semester_names = np.array([label[0] for label in labels], dtype=object)
+            week_names = np.array([label[1] for label in labels], dtype=object)
+            semesters[is_canvas] = semester_names[ids]
+            weeks[is_canvas] = week_names[ids]
+
+        for i in np.flatnonzero(~is_canvas).tolist():
+            semesters[i], weeks[i] = self.classify(dues[i])
+
+        return semesters.tolist(), weeks.tolist()
+
 
-    if custom_range and len(custom_range) == 2:
-        custom_start, custom_end = custom_range
-        if custom_start and custom_end and custom_start <= d <= custom_end:
-            return custom_label or "Custom Semester"
+# NumPy, imported on first batch classification so importing the integrations never pays for it; None if missing
+@lru_cache(maxsize=None)
+def _numpy():
+    try:
+        import numpy
+    except ImportError:  # batch classification falls back to the per-item path
+        return None
+    return numpy
+
+
+# Least recently used calendars are evicted once this many distinct settings are cached
+@lru_cache(maxsize=128)
+def _compiled_calendar(custom_range, custom_label, custom_phases, matric_year, utc_offset):
+    phases = [{"name": name, "start": start, "end": end} for name, start, end in custom_phases]
+    return AcademicCalendar(custom_range, custom_label, phases, matric_year, utc_offset)
+
+
+"""
+Return a compiled calendar for the given settings, built on first use and shared by every user with equal settings.
+"""
+def calendar_for(
+    custom_range: tuple | None = None,
+    custom_label: str | None = None,
+    custom_phases: list | None = None,
+    matric_year: int | None = None,
+    utc_offset: float | None = None,
+) -> AcademicCalendar:
+    frozen_phases = tuple(
+        (phase.get("name"), phase.get("start"), phase.get("end"))
+        for phase in custom_phases or []
+        if isinstance(phase, dict)
+    )
+    frozen_range = tuple(custom_range) if custom_range else None
+    return _compiled_calendar(
+        frozen_range,
+        custom_label,
+        frozen_phases,
+        matric_year if matric_year is not None else MATRIC_YEAR,
+        utc_offset if utc_offset is not None else UTC_OFFSET,
+    )
 
-    for name, start, end in SEMESTER_RANGES:
-        if start <= d <= end:
-            return name
-    return None
+
+"""
+Compute (semester, week) range names from a due date with a single parse.
+"""
+def compute_semester_and_week_from_due(
+    due: Union[date, datetime, str],
+    custom_range: tuple | None = None,
+    custom_label: str | None = None,
+    custom_phases: list | None = None,
+) -> tuple:
+    return calendar_for(custom_range, custom_label, custom_phases).classify(due)
+
+
+def compute_semester_from_due(
+    due: Union[date, datetime, str],
+    custom_range: tuple | None = None,
+    custom_label: str | None = None,
+    custom_phases: list | None = None,
+) -> str:
+    if due is None or due == "":
+        return "N/A"
+
+    calendar = calendar_for(custom_range, custom_label, custom_phases)
+    return calendar.labels_for_date(parse_due_date(due))[0]
 
 """
 Compute given week range name from due date.
@@ -69,41 +273,9 @@ def compute_week_from_due(
     custom_label: str | None = None,
     custom_phases: list | None = None,
 ) -> str:
-    semester = compute_semester_from_due(
+    return compute_semester_and_week_from_due(
         due,
         custom_range=custom_range,
         custom_label=custom_label,
         custom_phases=custom_phases,
-    )
-
-    if semester is None or semester == "N/A":
-        return "N/A"
-    elif "Special Term" in semester:
-        return "Special Term"
-    elif "Winter Term" in semester:
-        return "Winter Term"
-
-    WEEK_RANGES = WEEK_RANGES_BY_SEMESTER.get(semester, [])
-
-    # parse
-    if isinstance(due, str):
-        s = due.strip()
-
-        if "T" not in s:
-            d = date.fromisoformat(s)
-        else:
-            dt = datetime.fromisoformat(
-                s.replace("Z", "+00:00")
-            )
-            d = dt.astimezone(TIMEZONE).date()
-    elif isinstance(due, datetime):
-        if due.tzinfo is None:
-            due = due.replace(tzinfo=timezone.utc)
-        d = due.astimezone(TIMEZONE).date()
-    else:
-        d = due
-
-    for name, start, end in WEEK_RANGES:
-        if start <= d <= end:
-            return name
-    return None
+    )[1]
@@ -0,0 +1,33 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# Keep-alive connections kept open per host
+DEFAULT_POOL_SIZE = 10
+# Seconds to wait for a connection and for a response respectively
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+
+# requests.Session with pooled keep-alive adapters and a default timeout on every call
+class PooledSession(requests.Session):
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None, timeout=None):
+        super().__init__()
+        self.timeout = timeout or (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+        self.mount("https://", self._build_adapter(pool_size))
+        self.mount("http://", self._build_adapter(pool_size))
+
+        # Hosts with their own pool size, e.g. {"api.notion.com": 4}
+        for host, size in (host_pool_sizes or {}).items():
+            self.mount(f"https://{host}/", self._build_adapter(size))
+
+    def _build_adapter(self, pool_size):
+        return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def build_session(pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None, timeout=None):
+    return PooledSession(pool_size=pool_size, host_pool_sizes=host_pool_sizes, timeout=timeout)
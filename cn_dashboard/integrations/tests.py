@@ -1,3 +1,492 @@
-from django.test import TestCase
+import asyncio, itertools, json, shutil, tempfile, threading, time, unittest
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from . import notion as notion_module, ratelimit
+from .async_sync import AsyncSyncEngine, httpx
+from .canvas import CanvasApi, Class, hasSubmitted, plannerItemToAssignment
+from .config.semester_map import semester_ranges
+from .config.student import MATRIC_YEAR, UTC_OFFSET
+from .config.week_map import week_ranges_by_semester
+from .http_cache import DiskStore
+from .scripts import select_helpers
+from .scripts.select_helpers import calendar_for, compute_semester_from_due, compute_week_from_due
+from .notion import NotionApi
+from .pipeline import BoundedExecutor, stream
+from .user import User
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+        self.text = json.dumps(data)
+        self.headers = {}
+        self.links = {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code), response=self)
+
+
+def notionPage(page_id, url, title="Essay", className="CS1010"):
+    return {
+        "id": page_id,
+        "last_edited_time": "2024-09-01T00:00:00.000Z",
+        "properties": {
+            "URL": {"url": url},
+            "Assignment": {"title": [{"plain_text": title}]},
+            "Class": {"select": {"name": className}},
+        },
+    }
+
+
+# Stands in for the pooled requests session; answers Notion calls from canned query pages and echoes writes back
+class FakeNotionSession:
+    def __init__(self, queryPages=None):
+        self.queryPages = list(queryPages or [])
+        self.queries = []
+        self.created = 0
+
+    def request(self, method, url, data=None, **kwargs):
+        body = json.loads(data) if data else {}
+        if url.endswith("/query"):
+            self.queries.append(body)
+            return self.queryPages.pop(0) if self.queryPages else FakeResponse(200, {"results": [], "has_more": False})
+        if method == "GET":
+            return FakeResponse(200, {"object": "database", "properties": {}})
+        if method == "POST":
+            self.created += 1
+            properties = body["properties"]
+            return FakeResponse(200, {"id": f"created-{self.created}", "properties": properties})
+        return FakeResponse(200, {"id": url.rsplit("/", 1)[1], "properties": body.get("properties", {})})
+
+
+def queryResult(pages, has_more=False, next_cursor=None):
+    return FakeResponse(200, {"results": pages, "has_more": has_more, "next_cursor": next_cursor})
+
+
+class AssignmentIndexTests(SimpleTestCase):
+    def notion(self, session):
+        notion = NotionApi("index-test-token", database_id="db", session=session)
+        notion._db_properties = {}
+        return notion
+
+    def test_incremental_load_then_create_updates_index(self):
+        session = FakeNotionSession([queryResult([notionPage("edited", "https://canvas/2")])])
+        notion = self.notion(session)
+        stored = {"stored": {"url": "https://canvas/1", "key": "CS1010||Quiz", "fingerprint": {}, "last_edited_time": None}}
+
+        notion.loadAssignmentIndex(stored, datetime.now(timezone.utc) - timedelta(hours=1))
+        notion.createNewDatabaseItem(id=3, className="CS1010", assignmentName="Lab", url="https://canvas/3")
+
+        self.assertIn("filter", session.queries[0])
+        self.assertEqual(
+            notion.parseDatabaseForAssignments(),
+            {"https://canvas/1": "stored", "https://canvas/2": "edited", "https://canvas/3": "created-1"},
+        )
+
+    def test_stale_index_is_rebuilt_from_full_scan(self):
+        session = FakeNotionSession([queryResult([notionPage("live", "https://canvas/2")])])
+        notion = self.notion(session)
+        stored = {"archived": {"url": "https://canvas/1", "key": None, "fingerprint": {}, "last_edited_time": None}}
+
+        notion.loadAssignmentIndex(stored, datetime.now(timezone.utc) - timedelta(days=30))
+
+        self.assertNotIn("filter", session.queries[0])
+        self.assertEqual(notion.parseDatabaseForAssignments(), {"https://canvas/2": "live"})
+
+    def test_full_sync_ignores_stored_index(self):
+        session = FakeNotionSession([queryResult([notionPage("live", "https://canvas/2")])])
+        stored = {"archived": {"url": "https://canvas/1", "key": None, "fingerprint": {}, "last_edited_time": None}}
+        user = User(
+            "canvas-key", "index-test-token", "page", "canvas.test", database_id="db", session=session,
+            assignment_index={"pages": stored, "since": datetime.now(timezone.utc)},
+        )
+
+        user.prepareDatabase(full=True)
+
+        self.assertEqual(user.notionProfile.parseDatabaseForAssignments(), {"https://canvas/2": "live"})
+        self.assertNotIn("filter", session.queries[0])
+
+    def test_query_error_mid_paging_raises(self):
+        session = FakeNotionSession([
+            queryResult([notionPage("first", "https://canvas/1")], has_more=True, next_cursor="c"),
+            FakeResponse(400, {"object": "error", "message": "bad cursor"}),
+        ])
+        notion = self.notion(session)
+
+        with self.assertRaises(requests.HTTPError):
+            notion.parseDatabaseForAssignments()
+
+
+class WatermarkPlanningTests(SimpleTestCase):
+    def plan(self, assignment, pages=None):
+        if pages is None:
+            pages = [notionPage("page", "https://canvas/1", title="Essay")]
+        session = FakeNotionSession([queryResult(pages)])
+        user = User("canvas-key", "watermark-test-token", "page", "canvas.test", database_id="db", session=session)
+        user.notionProfile._db_properties = {}
+        watermark = datetime(2024, 9, 10, tzinfo=timezone.utc)
+        course = Class(1, "CS1010")
+
+        plan = user.startPlan([course], {1: watermark})
+        user.planCourseAssignments(plan, course, [assignment], watermarks={1: watermark})
+        return plan
+
+    def assignment(self, submission=None):
+        return {
+            "id": 1, "name": "Essay", "url": "https://canvas/1", "due_at": None,
+            "updated_at": "2024-09-01T00:00:00Z", "has_submitted_submissions": False, "submission": submission,
+        }
+
+    def test_untouched_assignment_before_watermark_is_dropped(self):
+        plan = self.plan(self.assignment({"workflow_state": "unsubmitted", "submitted_at": None}))
+        self.assertEqual((plan["create"], plan["update"]), ([], []))
+
+    def test_submission_after_watermark_is_planned(self):
+        plan = self.plan(self.assignment({"workflow_state": "submitted", "submitted_at": "2024-09-12T08:00:00Z"}))
+        self.assertEqual(len(plan["update"]), 1)
+
+    def test_planner_mode_ignores_stored_watermarks(self):
+        user = User(
+            "canvas-key", "watermark-test-token", "page", "canvas.test", database_id="db",
+            session=FakeNotionSession(), fetch_mode="planner", course_watermarks={1: datetime(2024, 9, 10, tzinfo=timezone.utc)},
+        )
+        self.assertEqual(user.prepareDatabase(), {})
+
+    def test_missing_page_is_recreated_despite_watermark(self):
+        plan = self.plan(self.assignment({"workflow_state": "unsubmitted", "submitted_at": None}), pages=[])
+        self.assertEqual(len(plan["create"]), 1)
+
+
+# The original front-to-back linear scan over the range tables, kept as the reference the compiled classifier must match
+def referenceClassify(due, custom_range=None, custom_label=None, custom_phases=None):
+    if due is None or due == "":
+        return "N/A", "N/A"
+
+    tz = timezone(timedelta(hours=UTC_OFFSET))
+    if isinstance(due, str):
+        d = date.fromisoformat(due) if "T" not in due else datetime.fromisoformat(due.replace("Z", "+00:00")).astimezone(tz).date()
+    elif isinstance(due, datetime):
+        d = (due if due.tzinfo else due.replace(tzinfo=timezone.utc)).astimezone(tz).date()
+    else:
+        d = due
+
+    semester = None
+    for phase in custom_phases or []:
+        start, end = date.fromisoformat(phase["start"]), date.fromisoformat(phase["end"])
+        if start <= d <= end:
+            semester = phase["name"]
+            break
+    if semester is None and custom_range and custom_range[0] <= d <= custom_range[1]:
+        semester = custom_label or "Custom Semester"
+    if semester is None:
+        semester = next((name for name, start, end in semester_ranges(MATRIC_YEAR) if start <= d <= end), None)
+
+    if semester is None:
+        return None, "N/A"
+    if "Special Term" in semester or "Winter Term" in semester:
+        return semester, "Special Term" if "Special Term" in semester else "Winter Term"
+    weeks = week_ranges_by_semester(MATRIC_YEAR).get(semester, [])
+    return semester, next((name for name, start, end in weeks if start <= d <= end), None)
+
+
+class CalendarClassificationTests(SimpleTestCase):
+    CONFIGS = [
+        {},
+        {"custom_phases": [{"name": "Exchange", "start": "2025-03-01", "end": "2025-05-20"}]},
+        {"custom_range": (date(2026, 1, 5), date(2026, 5, 2)), "custom_label": "Custom Term"},
+    ]
+
+    def dues(self):
+        first = date(MATRIC_YEAR - 1, 7, 1)
+        days = [first + timedelta(days=i) for i in range(366 * 7)]
+        dues = [None, ""]
+        for d in days:
+            # 20:00Z is already the next local day east of UTC, so day boundaries are exercised too
+            dues += [f"{d.isoformat()}T20:00:00Z", f"{d.isoformat()}T03:00:00Z", d.isoformat()]
+        dues += [datetime(d.year, d.month, d.day, 18) for d in days[::7]] + days[::11]
+        return dues
+
+    def test_matches_linear_scan(self):
+        dues = self.dues()
+        for config in self.CONFIGS:
+            calendar = calendar_for(config.get("custom_range"), config.get("custom_label"), config.get("custom_phases"))
+            expected = [referenceClassify(due, **config) for due in dues]
+            with self.subTest(config=config):
+                self.assertEqual([calendar.classify(due) for due in dues], expected)
+                self.assertEqual(list(zip(*calendar.classify_many(dues))), expected)
+                with mock.patch.object(select_helpers, "_numpy", lambda: None):
+                    self.assertEqual(list(zip(*calendar.classify_many(dues))), expected)
+
+    def test_wrappers_match_linear_scan(self):
+        for config in self.CONFIGS:
+            for due in self.dues()[::13]:
+                semester, week = referenceClassify(due, **config)
+                with self.subTest(config=config, due=due):
+                    self.assertEqual(compute_semester_from_due(due, **config), "N/A" if due in (None, "") else semester)
+                    self.assertEqual(compute_week_from_due(due, **config), week)
+
+
+class SubmissionStateTests(SimpleTestCase):
+    def test_handed_in_states_count_as_done(self):
+        for submission in (
+            {"workflow_state": "submitted", "submitted_at": "2024-09-01T00:00:00Z"},
+            {"workflow_state": "pending_review", "submitted_at": None},
+            {"workflow_state": "graded", "submitted_at": "2024-09-01T00:00:00Z"},
+            {"workflow_state": "graded", "submitted_at": None, "excused": True},
+        ):
+            with self.subTest(submission=submission):
+                self.assertTrue(hasSubmitted({"submission": submission}))
+
+    def test_graded_missing_work_is_not_done(self):
+        submission = {"workflow_state": "graded", "submitted_at": None, "missing": True, "score": 0}
+        self.assertFalse(hasSubmitted({"submission": submission, "has_submitted_submissions": True}))
+
+    def test_excused_planner_item_is_done(self):
+        item = {
+            "plannable_type": "assignment", "plannable_id": 7, "course_id": 1,
+            "plannable": {"title": "Lab"}, "submissions": {"submitted": False, "excused": True},
+        }
+        self.assertTrue(hasSubmitted(plannerItemToAssignment(item, "canvas.test")))
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class AsyncCanvasLimiterTests(SimpleTestCase):
+    def test_async_requests_report_to_the_host_limiter(self):
+        responses = [
+            httpx.Response(403, text="403 Forbidden (Rate Limit Exceeded)", headers={"X-Rate-Limit-Remaining": "0"}),
+            httpx.Response(200, json=[], headers={"X-Rate-Limit-Remaining": "140", "X-Request-Cost": "1"}),
+        ]
+        transport = httpx.MockTransport(lambda request: responses.pop(0))
+        user = User("canvas-key", "limiter-test-token", "page", "async-limiter.test")
+        limiter = user.canvasProfile.rateLimiter
+        limiter.limit = 4
+
+        async def fetch():
+            async with httpx.AsyncClient(transport=transport) as client:
+                engine = AsyncSyncEngine(user, client=client)
+                return await engine._canvasRequest("GET", "https://async-limiter.test/api/v1/courses")
+
+        with mock.patch.object(ratelimit, "CANVAS_DRAIN_RATE", 1000.0), mock.patch.object(ratelimit, "BACKOFF_BASE", 0.01):
+            res = asyncio.run(fetch())
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(responses, [])
+        # The 403 dropped the host to one request at a time and the low remaining budget kept it there
+        self.assertEqual(limiter.limit, 1)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.remaining, 140.0)
+
+
+class StreamTests(SimpleTestCase):
+    def test_source_error_reaches_the_caller(self):
+        def source():
+            yield 1
+            yield 2
+            raise ValueError("Canvas went away")
+
+        received = []
+        with self.assertRaisesMessage(ValueError, "Canvas went away"):
+            for item in stream(source(), 1):
+                received.append(item)
+        self.assertEqual(received, [1, 2])
+
+    def test_stopping_early_does_not_hang(self):
+        def consume():
+            items = stream(itertools.count(), 2)
+            taken.extend(next(items) for _ in range(3))
+            items.close()
+
+        taken = []
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        consumer.join(timeout=5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(taken, [0, 1, 2])
+
+
+class BoundedExecutorTests(SimpleTestCase):
+    def test_submit_blocks_once_workers_and_queue_are_full(self):
+        gate = threading.Event()
+        with BoundedExecutor(workers=1, maxsize=1) as executor:
+            # One task running plus one waiting fills workers + maxsize
+            futures = [executor.submit(gate.wait), executor.submit(gate.wait)]
+            submitter = threading.Thread(target=lambda: futures.append(executor.submit(lambda: "third")), daemon=True)
+            submitter.start()
+
+            submitter.join(timeout=0.2)
+            self.assertTrue(submitter.is_alive())
+
+            gate.set()
+            submitter.join(timeout=5)
+            self.assertFalse(submitter.is_alive())
+            self.assertEqual(futures[2].result(timeout=5), "third")
+
+
+# FakeNotionSession that also serves Canvas assignment lists by course id (403 for forbidden ones) and rejects creates titled Broken
+class FakeSyncSession(FakeNotionSession):
+    def __init__(self, queryPages=None, courses=None, forbidden=()):
+        super().__init__(queryPages)
+        self.courses = courses or {}
+        self.forbidden = forbidden
+
+    def request(self, method, url, data=None, **kwargs):
+        if "/api/v1/courses/" in url:
+            courseId = int(url.split("/api/v1/courses/")[1].split("/")[0])
+            if courseId in self.forbidden:
+                return FakeResponse(403, {"errors": [{"message": "user not authorized to perform that action"}]})
+            return FakeResponse(200, [dict(a) for a in self.courses.get(courseId, [])])
+        if method == "POST" and "Broken" in (data or ""):
+            return FakeResponse(400, {"object": "error", "message": "validation failed"})
+        return super().request(method, url, data=data, **kwargs)
+
+
+class UpsertPipelineTests(SimpleTestCase):
+    COURSES = {
+        1: [
+            {"id": 1, "name": "Essay", "html_url": "https://canvas.test/courses/1/assignments/1", "due_at": None},
+            {"id": 2, "name": "Lab", "html_url": "https://canvas.test/courses/1/assignments/2", "due_at": "2024-09-20T15:59:00Z"},
+            {"id": 3, "name": "Broken", "html_url": "https://canvas.test/courses/1/assignments/3", "due_at": None},
+        ],
+        2: [
+            {"id": 4, "name": "Quiz", "html_url": "https://canvas.test/courses/2/assignments/4", "due_at": None},
+            {"id": 4, "name": "Quiz", "html_url": "https://canvas.test/courses/2/assignments/4", "due_at": None},
+        ],
+    }
+
+    def user(self, token):
+        session = FakeSyncSession(
+            [queryResult([notionPage("essay-page", "https://canvas.test/courses/1/assignments/1")])],
+            courses=self.COURSES, forbidden={3},
+        )
+        user = User("canvas-key", token, "page", "canvas.test", database_id="db", session=session)
+        user.notionProfile._db_properties = {}
+        return user
+
+    def courses(self):
+        return [Class(1, "CS1010"), Class(2, "CS2030"), Class(3, "MA1521")]
+
+    def test_pipeline_matches_plan_then_execute(self):
+        user = self.user("pipeline-test-token")
+        plan, created, updated, errors = user.runUpsertPipeline(self.courses())
+        streamed = (created, updated, len(plan["skip"]), errors)
+
+        user = self.user("plan-execute-test-token")
+        plan = user.planDatabaseUpserts(self.courses())
+        created, updated, errors = user.executeUpsertPlan(plan)
+        batched = (created, updated, len(plan["skip"]), errors)
+
+        self.assertEqual(streamed, batched)
+        self.assertEqual(streamed[:3], (2, 1, 1))
+        self.assertEqual(
+            [(error["action"], error["course"]) for error in streamed[3]], [("fetch", "MA1521"), ("create", "CS1010")]
+        )
+
+
+# Hands back canned responses in order and counts the requests made
+class ScriptedSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+def statusResponse(status_code, headers=None):
+    res = FakeResponse(status_code, {})
+    res.headers = headers or {}
+    return res
+
+
+class NotionRetryTests(SimpleTestCase):
+    def test_429_pauses_the_shared_bucket_for_retry_after(self):
+        session = ScriptedSession([statusResponse(429, {"Retry-After": "0.05"}), statusResponse(200)])
+        notion = NotionApi("retry-429-token", database_id="db", session=session)
+        # Every client for the same token shares the bucket, so the pause holds all of them back
+        self.assertIs(NotionApi("retry-429-token").rateLimiter, notion.rateLimiter)
+
+        with mock.patch.object(notion.rateLimiter, "pause", wraps=notion.rateLimiter.pause) as pause:
+            res = notion._request("GET", "https://api.notion.com/v1/databases/db")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(session.calls, 2)
+        pause.assert_called_once_with(0.05)
+
+    def test_502_is_retried_up_to_max_retries(self):
+        session = ScriptedSession([statusResponse(502)])
+        notion = NotionApi("retry-502-token", database_id="db", session=session)
+        notion.rateLimiter = ratelimit.TokenBucket(1000.0, 10)
+
+        with mock.patch.object(notion_module.time, "sleep") as sleep:
+            res = notion._request("GET", "https://api.notion.com/v1/databases/db")
+
+        self.assertEqual(res.status_code, 502)
+        self.assertEqual(session.calls, ratelimit.MAX_RETRIES + 1)
+        self.assertEqual(sleep.call_count, ratelimit.MAX_RETRIES)
+
+    def test_map_writes_keeps_item_order(self):
+        notion = NotionApi("map-writes-token", write_workers=3)
+
+        def write(item):
+            # Later items finish first
+            time.sleep((5 - item) * 0.01)
+            return item * 10
+
+        self.assertEqual(notion.mapWrites(write, range(6)), [0, 10, 20, 30, 40, 50])
+
+
+# Canvas session double that replays responses and records the headers of every request
+class RecordingSession(ScriptedSession):
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.sentHeaders = []
+
+    def request(self, method, url, **kwargs):
+        self.sentHeaders.append(kwargs.get("headers") or {})
+        return super().request(method, url, **kwargs)
+
+
+class ConditionalGetTests(SimpleTestCase):
+    URL = "https://cache.test/api/v1/courses/1/assignments/"
+    NEXT = "https://cache.test/api/v1/courses/1/assignments/?page=2"
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.store = DiskStore(directory)
+
+    def test_304_is_answered_from_the_cache_per_token(self):
+        fresh = statusResponse(200, {"ETag": '"v1"'})
+        fresh.data = [{"id": 1}]
+        fresh.links = {"next": {"url": self.NEXT}}
+        session = RecordingSession([fresh, statusResponse(304)])
+        api = CanvasApi("token-a", "cache.test", session=session, cache=self.store)
+
+        self.assertEqual(api._get_page(self.URL), ([{"id": 1}], self.NEXT))
+        self.assertEqual(api._get_page(self.URL), ([{"id": 1}], self.NEXT))
+        self.assertNotIn("If-None-Match", session.sentHeaders[0])
+        self.assertEqual(session.sentHeaders[1]["If-None-Match"], '"v1"')
+
+        other = RecordingSession([statusResponse(200)])
+        CanvasApi("token-b", "cache.test", session=other, cache=self.store)._get_page(self.URL)
+        self.assertNotIn("If-None-Match", other.sentHeaders[0])
+
+    def test_disk_store_round_trips_and_expires(self):
+        self.store.set("canvas-http:abc", {"etag": '"v1"', "payload": [1, 2]})
+        self.assertEqual(self.store.get("canvas-http:abc"), {"etag": '"v1"', "payload": [1, 2]})
+
+        self.store.set("canvas-http:old", {"etag": '"v0"'}, timeout=-1)
+        self.assertIsNone(self.store.get("canvas-http:old"))
+        self.assertEqual(self.store.get("canvas-http:missing", "default"), "default")
 
-# Create your tests here.
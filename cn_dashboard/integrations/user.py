@@ -1,8 +1,23 @@
 import json, requests
-from .canvas import CanvasApi
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from .canvas import CanvasApi, assignmentChangedAt, hasSubmitted
+from .canvas_graphql import CanvasGraphQLApi
 from .notion import NotionApi
+from .pipeline import BoundedExecutor, stream
+from .session import build_session, DEFAULT_POOL_SIZE
 from .scripts.date_helpers import date_to_sg_offset_iso
 
+# Courses fetched from Canvas at once; 1 fetches them one after another
+DEFAULT_FETCH_WORKERS = 4
+# Canvas clients selectable with canvas_backend; "graphql" loads every course's assignments in a few requests
+CANVAS_BACKENDS = {"rest": CanvasApi, "graphql": CanvasGraphQLApi}
+# How assignments are gathered: "courses" asks each course in turn, "planner" reads one cross-course planner stream
+FETCH_MODES = ("courses", "planner")
+# Planned writes allowed to wait for a Notion worker; small bounds keep memory flat while Canvas reads overlap Notion writes
+PIPELINE_QUEUE_SIZE = 32
+
 class User:
     def __init__(
         self,
@@ -16,15 +31,46 @@ class User:
         semester_end_date=None,
         semester_label=None,
         semester_phases=None,
+        session=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        host_pool_sizes=None,
+        timeout=None,
+        fetch_workers=DEFAULT_FETCH_WORKERS,
+        assignment_index=None,
+        course_watermarks=None,
+        calendar=None,
+        canvas_backend="rest",
+        fetch_mode="courses",
+        canvas_cache=None,
     ):
+        if canvas_backend not in CANVAS_BACKENDS:
+            raise ValueError(f"Unknown Canvas backend: {canvas_backend}")
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode: {fetch_mode}")
+        self.fetch_mode = fetch_mode
         self.notionToken = notionToken
+        self.fetch_workers = max(1, fetch_workers or 1)
+        # Stored {"pages": ..., "since": ...} index for database_id, reconciled instead of a full scan
+        self.assignment_index = assignment_index
+        # course id -> time of the last sync that fully succeeded for that course
+        self.course_watermarks = course_watermarks or {}
+        self.syncedCourses = {}
         self.database_id = database_id
         self.db_properties = db_properties or []
         self.semester_start_date = semester_start_date
         self.semester_end_date = semester_end_date
         self.semester_label = semester_label
         self.semester_phases = semester_phases or []
-        self.canvasProfile = CanvasApi(canvasKey, schoolAb)
+        self.calendar = calendar
+        # Local offset for Notion due dates, following the calendar's when one is given
+        self.utc_offset = calendar.utc_offset if calendar is not None else None
+        # One pooled session shared by Canvas and Notion so every sync path reuses keep-alive connections
+        self.session = session or build_session(
+            pool_size=pool_size, host_pool_sizes=host_pool_sizes, timeout=timeout
+        )
+        self.canvasProfile = CANVAS_BACKENDS[canvas_backend](
+            canvasKey, schoolAb, session=self.session, cache=canvas_cache
+        )
         self.page_ids = {"Default": notionPageId}
         self.generated_db_id = None
         self.schoolAb = schoolAb
@@ -36,6 +82,8 @@ class User:
             semester_end_date=semester_end_date,
             semester_label=semester_label,
             semester_phases=semester_phases,
+            session=self.session,
+            calendar=calendar,
         )
 
     # Shorthand fucntion for getting list of courses that started within the past 6 months from Canvas
@@ -47,7 +95,49 @@ class User:
         return self.canvasProfile.get_all_courses()
 
     # Enters assignments into given database given (by id), or creates a new database, and fills the page with assignments not already found in the database
-    def enterAssignmentsToNotionDb(self, courseList, timeframe=None):
+    def enterAssignmentsToNotionDb(self, courseList, timeframe=None, full=False):
+        watermarks = self.prepareDatabase(full)
+
+        syncStartedAt = datetime.now(timezone.utc)
+        plan, created, updated, errors = self.runUpsertPipeline(courseList, timeframe, watermarks)
+
+        return self.finishSync(plan, created, updated, errors, syncStartedAt)
+
+    # Streams fetch -> plan -> write: each course is planned as soon as its assignments arrive and its writes start
+    # straight away, so Canvas reads for later courses overlap Notion writes for earlier ones.
+    # Returns (plan, created, updated, errors), matching planDatabaseUpserts + executeUpsertPlan
+    def runUpsertPipeline(self, courseList, timeframe=None, watermarks=None):
+        plan = self.startPlan(courseList, watermarks)
+        writes = []
+
+        with BoundedExecutor(self.notionProfile.write_workers, PIPELINE_QUEUE_SIZE) as writer:
+            fetched = stream(self.fetchCourseAssignments(plan["courses"], timeframe), self.fetch_workers)
+            for course, assignments, error in fetched:
+                creates, updates = len(plan["create"]), len(plan["update"])
+                self.planCourseAssignments(plan, course, assignments, error, watermarks)
+
+                for item in plan["create"][creates:]:
+                    writes.append(("create", writer.submit(self._createPlannedItem, item)))
+                for item in plan["update"][updates:]:
+                    writes.append(("update", writer.submit(self._updatePlannedItem, item)))
+
+        created = 0
+        updated = 0
+        errors = list(plan["errors"])
+        # Read back in plan order, so write errors are listed the same way whichever write finishes first
+        for action, future in writes:
+            error = future.result()
+            if error is not None:
+                errors.append(error)
+            elif action == "create":
+                created += 1
+            else:
+                updated += 1
+
+        return plan, created, updated, errors
+
+    # Makes sure the database exists and its index is loaded, returning the course watermarks that apply to it
+    def prepareDatabase(self, full=False):
         if not self.notionProfile.test_if_database_id_exists():
             self.notionProfile = NotionApi(
                 self.notionToken,
@@ -57,126 +147,255 @@ class User:
                 semester_end_date=self.semester_end_date,
                 semester_label=self.semester_label,
                 semester_phases=self.semester_phases,
+                session=self.session,
+                calendar=self.calendar,
             )
         # Cache DB properties once to ensure we only send supported fields.
         self.notionProfile.refresh_database_properties()
 
-        created, create_errors = self.addNewDatabaseItems(courseList, timeframe)
-        updated, update_errors = self.updateExistingDatabaseItems(courseList)
+        # A full sync rebuilds the index from a full scan, dropping pages that were archived or deleted in Notion
+        if self.assignment_index and not full and self.notionProfile.database_id == self.database_id:
+            self.notionProfile.loadAssignmentIndex(
+                self.assignment_index.get("pages", {}),
+                self.assignment_index.get("since"),
+            )
+
+        # Planner items carry no submission times, so a watermark would hide work handed in since the last sync
+        if self.fetch_mode == "planner":
+            return {}
+        # Watermarks belong to the stored database; a freshly created one needs everything
+        if not full and self.notionProfile.database_id == self.database_id:
+            return self.course_watermarks
+        return {}
 
-        errors = []
-        errors.extend(create_errors)
-        errors.extend(update_errors)
+    # Records which courses synced cleanly and returns the {created, updated, skipped, errors} result
+    def finishSync(self, plan, created, updated, errors, syncStartedAt):
+        # Only advance a course's watermark when nothing about it failed, so failures are retried next run
+        failedCourses = {error.get("course") for error in errors}
+        self.syncedCourses = {
+            course.id: syncStartedAt
+            for course in plan["courses"]
+            if course.name not in failedCourses
+        }
+        # A planner window only covers part of each course, so it can't vouch for the rest of it
+        if self.fetch_mode == "planner":
+            self.syncedCourses = {}
 
-        return {"created": created, "updated": updated, "errors": errors}
+        return {"created": created, "updated": updated, "skipped": len(plan["skip"]), "errors": errors}
 
     # Creates a new Canvas Assignments database in the notionPageId page
     def createDatabase(self, page_id_name="Default", properties=None):
         return self.notionProfile.createNewDatabase(self.page_ids[page_id_name], properties=properties)
 
-    # This function adds NEW assignments to the database based on whether the assignments URL can be found in the notion database
-    def addNewDatabaseItems(self, courseList, timeframe=None):
-        self.canvasProfile.set_courses_and_id()
-        created = 0
-        errors = []
+    # Records the ids of already-fetched courses so assignment lookups don't re-download the course list
+    def registerCourses(self, courseList):
+        for course in courseList:
+            if course.name not in self.canvasProfile.courses:
+                self.canvasProfile.courses[course.name] = course.id
+
+    # Fetches every course's assignments once and sorts each one into create, update or skip against the Notion index
+    def planDatabaseUpserts(self, courseList, timeframe=None, watermarks=None):
+        plan = self.startPlan(courseList, watermarks)
+        for course, assignments, error in self.fetchCourseAssignments(plan["courses"], timeframe):
+            self.planCourseAssignments(plan, course, assignments, error, watermarks)
+        return plan
+
+    # Empty plan for courseList; with watermarks, concluded courses synced before are left out
+    def startPlan(self, courseList, watermarks=None):
+        watermarks = watermarks or {}
+        self.registerCourses(courseList)
+        # Load the Notion index up front so planning each course is a pure in-memory lookup
+        self.notionProfile.parseDatabaseForAssignments()
+
+        courseList = [
+            course for course in courseList
+            if not (course.concluded and course.id in watermarks)
+        ]
+        return {"create": [], "update": [], "skip": [], "errors": [], "courses": courseList, "seen": set()}
+
+    # Sorts one course's fetched assignments into the plan. Pages already in Notion are only revisited when the
+    # assignment changed since the course's watermark; assignments with no page are always created
+    def planCourseAssignments(self, plan, course, assignments, error=None, watermarks=None):
+        if error is not None:
+            plan["errors"].append(error)
+            return
+
         existing_by_url = self.notionProfile.parseDatabaseForAssignments()
         existing_by_key = self.notionProfile.parseDatabaseForAssignmentsByKey()
+        seen = plan["seen"]
+        watermark = (watermarks or {}).get(course.id)
+
+        for assignment in assignments:
+            assignment_url = assignment.get("url")
+            assignment_key = f"{course.name}||{assignment.get('name')}"
+            item = {"course": course.name, "assignment": assignment, "page_id": None}
+
+            # Canvas can list the same assignment twice across pages, only act on it once
+            if assignment_url in seen:
+                plan["skip"].append(item)
+                continue
+            seen.add(assignment_url)
+
+            if assignment_url in existing_by_url:
+                item["page_id"] = existing_by_url.get(assignment_url)
+            elif assignment_key in existing_by_key:
+                item["page_id"] = existing_by_key.get(assignment_key)
+
+            if not item["page_id"]:
+                # Also covers pages deleted or archived in Notion, however old the assignment is
+                plan["create"].append(item)
+            elif watermark is not None and isUnchangedSince(assignment, watermark):
+                continue
+            elif self.notionProfile.isPageUnchanged(item["page_id"], **self._itemFields(item)):
+                # Nothing differs from what's in Notion, so don't spend write budget on a no-op PATCH
+                plan["skip"].append(item)
+            else:
+                plan["update"].append(item)
+
+    # Yields (course, assignments, error) for every course in courseList order, fetching up to fetch_workers courses at once
+    def fetchCourseAssignments(self, courseList, timeframe=None):
+        courseList = list(courseList)
+
+        if self.fetch_mode == "planner":
+            yield from self.fetchPlannerAssignments(courseList, timeframe)
+            return
+
+        if self.fetch_workers == 1 or len(courseList) <= 1:
+            for course in courseList:
+                yield (course, *self._fetchCourseAssignments(course, timeframe))
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(courseList))) as executor:
+            # map() yields in courseList order even when a later course's fetch finishes first
+            results = executor.map(
+                lambda course: self._fetchCourseAssignments(course, timeframe), courseList
+            )
+            for course, (assignments, error) in zip(courseList, results):
+                yield course, assignments, error
+
+    # Same contract as fetchCourseAssignments, but served from one planner stream instead of a request per course
+    def fetchPlannerAssignments(self, courseList, timeframe=None):
+        byCourse = defaultdict(list)
+        try:
+            for assignment in self.canvasProfile.iter_planner_assignments(*self.plannerWindow(timeframe)):
+                byCourse[assignment.get("course_id")].append(assignment)
+        except Exception as e:
+            for course in courseList:
+                yield course, [], {"action": "fetch", "course": course.name, "error": str(e)}
+            return
 
         for course in courseList:
-            assignmentObjects = self.canvasProfile.get_assignment_objects(
-                course.name, timeframe
+            yield course, byCourse.get(course.id, []), None
+
+    # (start_date, end_date) for the planner: an explicit pair, or the semester narrowed by a Canvas bucket name
+    def plannerWindow(self, timeframe=None):
+        if isinstance(timeframe, (tuple, list)):
+            return tuple(timeframe)
+
+        start, end = self.semester_start_date, self.semester_end_date
+        if timeframe in ("future", "upcoming"):
+            start = date.today()
+        elif timeframe in ("past", "overdue"):
+            end = date.today()
+        return start, end
+
+    # Returns (assignments, error) for one course so a failing course doesn't abort the whole sync
+    def _fetchCourseAssignments(self, course, timeframe=None):
+        try:
+            return list(self.canvasProfile.iter_assignment_objects(course.name, timeframe)), None
+        except Exception as e:
+            return [], {"action": "fetch", "course": course.name, "error": str(e)}
+
+    # Runs a plan from planDatabaseUpserts and returns (created, updated, errors)
+    def executeUpsertPlan(self, plan):
+        created = 0
+        updated = 0
+        errors = list(plan.get("errors", []))
+
+        for error in self.notionProfile.mapWrites(self._createPlannedItem, plan.get("create", [])):
+            if error is None:
+                created += 1
+            else:
+                errors.append(error)
+
+        for error in self.notionProfile.mapWrites(self._updatePlannedItem, plan.get("update", [])):
+            if error is None:
+                updated += 1
+            else:
+                errors.append(error)
+
+        return created, updated, errors
+
+    # Notion item fields derived from a planned item's Canvas assignment
+    def _itemFields(self, item):
+        assignment = item["assignment"]
+        due_date = assignment.get("due_at")
+        return {
+            "className": item["course"],
+            "dueDate": (
+                date_to_sg_offset_iso(due_date, self.utc_offset)
+                if due_date is not None
+                else None
+            ),
+            "url": assignment.get("url"),
+            "assignmentName": assignment["name"],
+            "has_submitted": hasSubmitted(assignment),
+        }
+
+    # Creates the Notion page for a planned item, returning an error dict on failure
+    def _createPlannedItem(self, item):
+        courseName = item["course"]
+        assignment = item["assignment"]
+        try:
+            res = self.notionProfile.createNewDatabaseItem(
+                id=assignment["id"],
+                **self._itemFields(item),
+            )
+            status = getattr(res, 'status_code', None)
+            if status and 200 <= status < 300:
+                return None
+            return {"action": "create", "course": courseName, "url": assignment.get("url"), "response": getattr(res, 'text', str(res))}
+        except Exception as e:
+            return {"action": "create", "course": courseName, "url": assignment.get("url"), "error": str(e)}
+
+    # Updates the matched Notion page for a planned item, returning an error dict on failure
+    def _updatePlannedItem(self, item):
+        courseName = item["course"]
+        assignment = item["assignment"]
+        try:
+            res = self.notionProfile.updateDatabaseItem(
+                page_id=item["page_id"],
+                **self._itemFields(item),
             )
-            for assignment in assignmentObjects:
-                assignment_url = assignment.get("url")
-                assignment_key = f"{course.name}||{assignment.get('name')}"
-
-                if assignment_url in existing_by_url or assignment_key in existing_by_key:
-                    continue
-
-                due_date = assignment.get("due_at")
-                dueDate = (
-                    date_to_sg_offset_iso(due_date)
-                    if due_date is not None
-                    else None
-                )
-                try:
-                    res = self.notionProfile.createNewDatabaseItem(
-                        id=assignment["id"],
-                        className=course.name,
-                        dueDate=dueDate,
-                        url=assignment["url"],
-                        assignmentName=assignment["name"],
-                        has_submitted=assignment["has_submitted_submissions"],
-                    )
-                    status = getattr(res, 'status_code', None)
-                    if status and 200 <= status < 300:
-                        created += 1
-                    else:
-                        errors.append({"action": "create", "course": course.name, "url": assignment.get("url"), "response": getattr(res, 'text', str(res))})
-                except Exception as e:
-                    errors.append({"action": "create", "course": course.name, "url": assignment.get("url"), "error": str(e)})
+            status = getattr(res, 'status_code', None)
+            if status and 200 <= status < 300:
+                return None
+            return {"action": "update", "course": courseName, "url": assignment.get("url"), "response": getattr(res, 'text', str(res))}
+        except Exception as e:
+            return {"action": "update", "course": courseName, "url": assignment.get("url"), "error": str(e)}
 
+    # This function adds NEW assignments to the database based on whether the assignments URL can be found in the notion database
+    def addNewDatabaseItems(self, courseList, timeframe=None):
+        plan = self.planDatabaseUpserts(courseList, timeframe)
+        created, _, errors = self.executeUpsertPlan({"create": plan["create"], "errors": plan["errors"]})
         return created, errors
-    
+
     # This function updates EXISTING assignments in the database based on whether the assignments URL can be found in the notion database
     def updateExistingDatabaseItems(self, courseList):
-        self.canvasProfile.set_courses_and_id()
-        updated = 0
-        errors = []
-        notionAssignments = self.notionProfile.parseDatabaseForAssignments()
-        notionAssignmentsByKey = self.notionProfile.parseDatabaseForAssignmentsByKey()
-
-        for course in courseList:
-            courseName = course.name
-            assignmentObjects = self.canvasProfile.get_assignment_objects(courseName)
-
-            for assignment in assignmentObjects:
-                assignment_url = assignment.get("url")
-                assignment_key = f"{courseName}||{assignment.get('name')}"
-                page_id = None
-                if assignment_url in notionAssignments:
-                    page_id = notionAssignments.get(assignment_url)
-                elif assignment_key in notionAssignmentsByKey:
-                    page_id = notionAssignmentsByKey.get(assignment_key)
-
-                if page_id:
-                    due_date = assignment.get("due_at")
-                    dueDate = (
-                        date_to_sg_offset_iso(due_date)
-                        if due_date is not None
-                        else None
-                    )
-
-                    try:
-                        res = self.notionProfile.updateDatabaseItem(
-                            page_id=page_id,
-                            className=courseName,
-                            dueDate=dueDate,
-                            assignmentName=assignment["name"],
-                            has_submitted=assignment["has_submitted_submissions"],
-                        )
-                        status = getattr(res, 'status_code', None)
-                        if status and 200 <= status < 300:
-                            updated += 1
-                        else:
-                            errors.append({"action": "update", "course": courseName, "url": assignment.get("url"), "response": getattr(res, 'text', str(res))})
-                    except Exception as e:
-                        errors.append({"action": "update", "course": courseName, "url": assignment.get("url"), "error": str(e)})
-
+        plan = self.planDatabaseUpserts(courseList)
+        _, updated, errors = self.executeUpsertPlan({"update": plan["update"], "errors": plan["errors"]})
         return updated, errors
 
-    # This function adds all found assignments to the notion database
+    # This function adds all found assignments to the notion database, writing each course while the next is fetched
     def rawFillDatabase(self, courseList):
-        self.canvasProfile.set_courses_and_id()
-        for course in courseList:
-            for assignment in self.canvasProfile.get_assignment_objects(
-                course.name, "upcoming"
-            ):
-                self.notionProfile.createNewDatabaseItem(
-                    id=assignment["id"],
-                    className=course.name,
-                    dueDate=date_to_sg_offset_iso(assignment["due_at"]),
-                    url=assignment["url"],
-                    assignmentName=assignment["name"],
-                    has_submitted=assignment["has_submitted_submissions"],
-                )
+        self.registerCourses(courseList)
+        with BoundedExecutor(self.notionProfile.write_workers, PIPELINE_QUEUE_SIZE) as writer:
+            for course, assignments, error in stream(self.fetchCourseAssignments(courseList, "upcoming"), self.fetch_workers):
+                for assignment in assignments:
+                    writer.submit(self._createPlannedItem, {"course": course.name, "assignment": assignment, "page_id": None})
+
+
+# Whether nothing the sync writes for an assignment changed after the watermark
+def isUnchangedSince(assignment, watermark):
+    changedAt = assignmentChangedAt(assignment)
+    return changedAt is not None and changedAt <= watermark